@@ -0,0 +1,257 @@
+"""
+Batch generation of model files over a catalog of reflection groups.
+
+A catalog is a JSON list of jobs. Each job names a reflection group, and
+optionally a base point, a projection plane and an output name::
+
+    [{"group": ["A", 3]},
+     {"group": ["H", 3], "point": [1, 2, 3]},
+     {"group": [5, 1, 2], "point": [1, 2], "proj_plane": [0, 1, 0, 1],
+      "name": "G512"}]
+
+Real groups are given by their Cartan type, complex groups by their
+Shephard-Todd parameters. Every job builds a :class:`ReflectionGroup3d` and
+exports it with :meth:`ReflectionGroup3d.export_mesh`, or with the format
+``cayley`` stores it with :meth:`ReflectionGroup3d.export_stored`, making the
+output directory a :class:`cayley_catalog.ModelCatalog`. Jobs run in a pool of
+worker processes, each holding one Sage session. Finished files are written
+atomically, so rerunning the same command after an interruption skips the
+jobs that already completed.
+
+Run from the command line with a Sage python, for example::
+
+    sage -python cayley_batch.py gallery.json models/ --workers 8 --format stl
+
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import traceback
+from time import localtime, strftime, time
+
+from cayley_catalog import ModelCatalog
+
+
+MODEL_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cayley_model.py")
+
+_model_namespace = None
+
+
+def load_model_namespace():
+    """
+    Return the Sage namespace in which ``cayley_model.py`` was loaded,
+    loading it the first time this is called in a process.
+
+    The namespace provides ``ReflectionGroup`` and ``ReflectionGroup3d``.
+    """
+    global _model_namespace
+    if _model_namespace is None:
+        namespace = {}
+        exec("from sage.all import *", namespace)
+        namespace["load"](MODEL_FILE, namespace)
+        _model_namespace = namespace
+    return _model_namespace
+
+
+def job_name(job):
+    """
+    Return the output name of ``job``: its ``"name"`` if given, otherwise one
+    made from the group type and the base point.
+
+    The name is used as a file name in the output directory, so names that
+    are not plain file names raise a ``ValueError``.
+
+    EXAMPLES::
+
+        >>> job_name({"group": ["A", 3]})
+        'A3'
+        >>> job_name({"group": [5, 1, 2], "point": [1, 2]})
+        'G5-1-2_1-2'
+        >>> job_name({"group": ["B", 3], "name": "cube"})
+        'cube'
+        >>> job_name({"group": ["B", 3], "name": "../cube"})
+        Traceback (most recent call last):
+        ...
+        ValueError: the output name '../cube' is not a plain file name
+    """
+    if "name" in job:
+        name = job["name"]
+    else:
+        group = job["group"]
+        if isinstance(group[0], str):
+            name = "%s%s" % tuple(group)
+        else:
+            name = "G" + "-".join(str(x) for x in group)
+        if "point" in job:
+            name += "_" + "-".join(str(x) for x in job["point"])
+    if not name or name in (".", "..") or "/" in name or "\\" in name:
+        raise ValueError("the output name %r is not a plain file name" % name)
+    return name
+
+
+def job_spec(job):
+    """
+    Return the normalized description ``[group, point, proj_plane]`` of the
+    model built by ``job``, with ``None`` for the defaults.
+
+    Two jobs building the same model have equal specifications, whatever
+    their names and however their numbers are written; stored models record
+    it in their metadata, see :meth:`cayley_catalog.ModelCatalog.find`.
+
+    EXAMPLES::
+
+        >>> job_spec({"group": ["A", 3], "point": [1, 2, 3], "name": "x"})
+        [['A', 3], [1.0, 2.0, 3.0], None]
+        >>> job_spec({"group": (5, 1, 2), "point": (1.0, 2)}) == \\
+        ...     job_spec({"group": [5, 1, 2], "point": [1, 2.0]})
+        True
+    """
+    group = [x if isinstance(x, str) else int(x) for x in job["group"]]
+    return [group] + [[float(x) for x in job[name]] if name in job else None
+                      for name in ("point", "proj_plane")]
+
+
+def load_catalog(filename):
+    """
+    Return the list of jobs in the catalog file ``filename``, checking that
+    every job names a group and that output names are unique.
+    """
+    with open(filename) as f:
+        jobs = json.load(f)
+    names = set()
+    for job in jobs:
+        if "group" not in job:
+            raise ValueError("catalog entry %s does not name a group" % job)
+        name = job_name(job)
+        if name in names:
+            raise ValueError("two catalog entries are named %s" % name)
+        names.add(name)
+    return jobs
+
+
+def make_group(namespace, group):
+    """
+    Return the reflection group given by ``group``, a Cartan type such as
+    ``["A", 3]`` or Shephard-Todd parameters such as ``[5, 1, 2]``.
+    """
+    if isinstance(group[0], str):
+        return namespace["ReflectionGroup"](list(group))
+    return namespace["ReflectionGroup"](tuple(group))
+
+
+def make_model(namespace, job):
+    """
+    Return the :class:`ReflectionGroup3d` of ``job``, built in the Sage
+    namespace ``namespace`` (see :func:`load_model_namespace`).
+    """
+    W = make_group(namespace, job["group"])
+    kwds = {}
+    if "point" in job:
+        kwds["point"] = tuple(job["point"])
+    if "proj_plane" in job:
+        kwds["proj_plane"] = list(job["proj_plane"])
+    return namespace["ReflectionGroup3d"](W, **kwds)
+
+
+def build_job(job, output_dir, fmt):
+    """
+    Build and export the model of ``job`` into ``output_dir``.
+
+    The file is written under a temporary name and renamed once complete.
+
+    OUTPUT:
+
+    A dictionary describing the outcome, with the job name, the status
+    (``"ok"`` or ``"failed"``), the elapsed time and either the output
+    filename or the error traceback.
+    """
+    name = job_name(job)
+    filename = os.path.join(output_dir, "%s.%s" % (name, fmt))
+    start = time()
+    try:
+        model = make_model(load_model_namespace(), job)
+        if fmt == "cayley":
+            triangles = model.export_stored(filename, {"job":job_spec(job)})
+        else:
+            partial = filename + ".part"
+            triangles = model.export_mesh(partial, fmt)
+            os.rename(partial, filename)
+    except Exception:
+        return {"name":name, "status":"failed", "time":time() - start,
+                "error":traceback.format_exc()}
+    return {"name":name, "status":"ok", "time":time() - start,
+            "file":filename, "triangles":triangles}
+
+
+def _run(args):
+    return build_job(*args)
+
+
+def run_catalog(jobs, output_dir, fmt="stl", workers=None, log=sys.stdout):
+    """
+    Build all ``jobs`` whose output file is not yet in ``output_dir``, using
+    a pool of ``workers`` processes (by default one per core).
+
+    Progress and failures are reported to ``log`` as jobs finish, and a
+    summary of this run is written to ``output_dir`` as
+    ``report-<date>-<time>.json``, so the reports of earlier runs are kept.
+
+    OUTPUT:
+
+    The list of job results, see :func:`build_job`.
+    """
+    started = time()
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    todo = [job for job in jobs
+            if not os.path.exists(os.path.join(output_dir, "%s.%s" % (job_name(job), fmt)))]
+    log.write("%s of %s jobs already done, %s to build\n"
+              % (len(jobs) - len(todo), len(jobs), len(todo)))
+
+    results = []
+    if todo:
+        pool = multiprocessing.Pool(workers)
+        try:
+            tasks = [(job, output_dir, fmt) for job in todo]
+            for n, result in enumerate(pool.imap_unordered(_run, tasks), 1):
+                results.append(result)
+                log.write("[%s/%s] %s: %s (%.1fs)\n"
+                          % (n, len(todo), result["name"], result["status"], result["time"]))
+                if result["status"] == "failed":
+                    log.write(result["error"])
+                log.flush()
+        finally:
+            pool.close()
+            pool.join()
+
+    report = strftime("report-%Y%m%d-%H%M%S.json", localtime(started))
+    with open(os.path.join(output_dir, report), "w") as f:
+        json.dump(results, f, indent=1)
+    if fmt == "cayley":
+        ModelCatalog(output_dir).reindex()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build model files for a catalog of reflection groups.")
+    parser.add_argument("catalog", help="JSON list of jobs")
+    parser.add_argument("output_dir", help="directory for the model files")
+    parser.add_argument("--format", default="stl", choices=("stl", "obj", "3mf", "cayley"))
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    args = parser.parse_args(argv)
+
+    results = run_catalog(load_catalog(args.catalog), args.output_dir,
+                          args.format, args.workers)
+    failed = [r["name"] for r in results if r["status"] == "failed"]
+    if failed:
+        sys.stderr.write("failed: %s\n" % ", ".join(failed))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Benchmarks for building, classifying, rendering and exporting models.
+
+For each group of a fixed list, the phases of a model's life are timed
+separately, and the peak of the Python heap during each is measured with
+:mod:`tracemalloc`. This covers the numpy arrays and Python objects of the
+model, but not the memory held by GAP (gap3 or libgap), so it understates
+the phases dominated by group enumeration:
+
+- ``__init__`` -- the complete (eager) constructor, with a cold group cache
+
+- ``_construct_vertices_dict``, ``_construct_edges_dict``, ``_outside_edges``,
+  ``plot3d``, ``export_mesh`` -- each step on its own, in this order, on a
+  lazily constructed model with a cold group cache
+
+Results are written as JSON together with the order of every group, so they
+can be plotted against the group order. Comparing them with a stored
+baseline flags phases that became slower.
+
+Run with a Sage python, for example::
+
+    sage -python cayley_bench.py --output bench.json --baseline baseline.json
+
+"""
+
+import argparse
+import io
+import json
+import platform
+import sys
+import tracemalloc
+from time import time
+
+from cayley_batch import job_name, load_model_namespace, make_group
+
+
+DEFAULT_GROUPS = ([["A", 3], ["B", 3], ["H", 3]] +
+                  [[m, 1, 2] for m in (3, 4, 6, 8, 12)] +
+                  [[m, m, 2] for m in (3, 4, 6, 8, 12)])
+
+PHASES = ("__init__", "_construct_vertices_dict", "_construct_edges_dict",
+          "_outside_edges", "plot3d", "export_mesh")
+
+
+def _phase_steps(namespace, W):
+    """
+    Return a function creating the list of ``(phase, function)`` pairs
+    measured for ``W``. The phases after ``__init__`` run in order on one
+    model, so every run needs a fresh list.
+    """
+    def steps():
+        model = []
+        def init():
+            namespace["group_data_cache"].clear()
+            namespace["ReflectionGroup3d"](W)
+        def lazy_vertices():
+            namespace["group_data_cache"].clear()
+            model.append(namespace["ReflectionGroup3d"](W, lazy=True))
+            model[0]._construct_vertices_dict()
+        return [("__init__", init),
+                ("_construct_vertices_dict", lazy_vertices),
+                ("_construct_edges_dict", lambda: model[0]._construct_edges_dict()),
+                ("_outside_edges", lambda: model[0]._outside_edges()),
+                ("plot3d", lambda: model[0].plot3d()),
+                ("export_mesh", lambda: model[0].export_mesh(io.BytesIO(), "stl"))]
+    return steps
+
+
+def measure(steps, repeat=3):
+    """
+    Run the phases returned by ``steps()`` ``repeat`` times for timing, and
+    once more under :mod:`tracemalloc` for the peak of the Python heap.
+
+    OUTPUT:
+
+    A dictionary mapping each phase to a dictionary with its best time in
+    seconds (``"time"``) and the peak in bytes of the Python heap traced by
+    :mod:`tracemalloc` (``"python_heap_peak"``), which leaves out memory
+    allocated by GAP.
+
+    EXAMPLES::
+
+        >>> result = measure(lambda: [("sum", lambda: sum(range(1000)))], repeat=2)
+        >>> sorted(result["sum"])
+        ['python_heap_peak', 'time']
+    """
+    times = {}
+    for run in range(repeat):
+        for phase, step in steps():
+            start = time()
+            step()
+            elapsed = time() - start
+            times[phase] = min(times.get(phase, elapsed), elapsed)
+
+    results = {}
+    for phase, step in steps():
+        tracemalloc.start()
+        step()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results[phase] = {"time":times[phase], "python_heap_peak":peak}
+    return results
+
+
+def run_benchmarks(groups=DEFAULT_GROUPS, repeat=3, log=sys.stdout):
+    """
+    Benchmark every group of ``groups`` (given as in a batch catalog, see
+    :mod:`cayley_batch`) and return the results as a JSON-serializable
+    dictionary.
+    """
+    namespace = load_model_namespace()
+    results = {"python":platform.python_version(), "time":time(), "groups":[]}
+    for group in groups:
+        name = job_name({"group":group})
+        W = make_group(namespace, group)
+        log.write("%s (order %s)\n" % (name, W.cardinality()))
+        phases = measure(_phase_steps(namespace, W), repeat)
+        for phase in PHASES:
+            log.write("    %-26s %9.3fs %10.1f MiB Python heap\n"
+                      % (phase, phases[phase]["time"], phases[phase]["python_heap_peak"]/2.**20))
+        log.flush()
+        results["groups"].append({"name":name, "group":group,
+                                  "order":int(W.cardinality()), "phases":phases})
+    return results
+
+
+def compare(results, baseline, threshold=1.25, minimum=0.01):
+    """
+    Return the phases of ``results`` that are more than ``threshold`` times
+    slower than in ``baseline``.
+
+    Phases faster than ``minimum`` seconds in the baseline are ignored, as
+    their timings are mostly noise.
+
+    OUTPUT:
+
+    A list of tuples ``(group name, phase, baseline time, new time)``.
+
+    EXAMPLES::
+
+        >>> old = {"groups": [{"name": "A3", "phases": {"plot3d": {"time": 1.0}}}]}
+        >>> new = {"groups": [{"name": "A3", "phases": {"plot3d": {"time": 1.5}}}]}
+        >>> compare(new, old)
+        [('A3', 'plot3d', 1.0, 1.5)]
+        >>> compare(new, old, threshold=2)
+        []
+    """
+    old_groups = {group["name"]:group["phases"] for group in baseline["groups"]}
+    regressions = []
+    for group in results["groups"]:
+        old_phases = old_groups.get(group["name"], {})
+        for phase, result in sorted(group["phases"].items()):
+            if phase not in old_phases:
+                continue
+            old_time = old_phases[phase]["time"]
+            if old_time >= minimum and result["time"] > threshold*old_time:
+                regressions.append((group["name"], phase, old_time, result["time"]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark model construction, classification, rendering and export.")
+    parser.add_argument("--output", default="bench.json", help="file for the JSON results")
+    parser.add_argument("--baseline", help="JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=1.25,
+                        help="slowdown ratio reported as a regression")
+    parser.add_argument("--repeat", type=int, default=3, help="timing runs per phase")
+    parser.add_argument("--groups", help="JSON list of groups, by default %s" % json.dumps(DEFAULT_GROUPS))
+    args = parser.parse_args(argv)
+
+    groups = json.loads(args.groups) if args.groups else DEFAULT_GROUPS
+    results = run_benchmarks(groups, args.repeat)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for name, phase, old, new in regressions:
+            sys.stderr.write("regression: %s %s %.3fs -> %.3fs\n" % (name, phase, old, new))
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
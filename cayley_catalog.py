@@ -0,0 +1,408 @@
+"""
+Memory-mapped on-disk storage of built models.
+
+A built :class:`ReflectionGroup3d` is written by
+:meth:`ReflectionGroup3d.export_stored` as one file holding its arrays: the
+vertex positions, the root permutations of the elements, the coset tables
+and adjacency index, the property columns, the pre-tessellated triangle
+mesh and the glTF instance buffers. The file starts with a JSON header describing the arrays and the
+model, followed by the raw little-endian array data, each array aligned to
+64 bytes::
+
+    b"CAYLEYM1" | header length (uint64) | JSON header | arrays
+
+:class:`StoredModel` opens such a file with :mod:`mmap`; its arrays are
+read-only views of the mapping, so nothing is copied or unpickled, and
+processes opening the same file share its pages through the OS cache.
+Opening a model needs neither Sage nor gap3, only numpy.
+
+A :class:`ModelCatalog` is a directory of stored models with an
+``index.json`` listing them by name, with the header metadata of each.
+Models stored with a ``"job"`` specification in their metadata (see
+:func:`cayley_batch.job_spec`) can also be found by it.
+
+This module only depends on numpy and the standard library.
+
+EXAMPLES::
+
+    >>> import os, tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> points = numpy.eye(3)
+    >>> write_stored(os.path.join(directory, "T.cayley"),
+    ...              {"mesh/points": points, "mesh/triangles": [[0, 1, 2]]},
+    ...              {"group": "triangle", "job": [["A", 2], None, None]})
+    >>> catalog = ModelCatalog(directory)
+    >>> catalog.reindex()
+    ['T']
+    >>> catalog.find([["A", 2], None, None]), catalog.find([["A", 3], None, None])
+    ('T', None)
+    >>> model = catalog.open("T")
+    >>> model.meta["group"], model["mesh/points"].flags.writeable
+    ('triangle', False)
+    >>> import io
+    >>> model.export_mesh(io.BytesIO(), "stl")
+    1
+
+"""
+
+import io
+import json
+import mmap
+import os
+import struct
+
+import numpy
+
+from cayley_export import format_from_filename, write_glb, write_mesh
+
+
+MAGIC = b"CAYLEYM1"
+
+EXTENSION = ".cayley"
+
+_ALIGNMENT = 64
+
+
+def write_stored(filename, arrays, meta=None):
+    """
+    Write the dictionary of arrays ``arrays`` and the JSON-serializable
+    dictionary ``meta`` to ``filename`` in the stored model format.
+
+    The file is written under a temporary name and renamed once complete,
+    so a model being replaced can still be read by other processes.
+
+    EXAMPLES::
+
+        >>> import os, tempfile
+        >>> filename = os.path.join(tempfile.mkdtemp(), "a.cayley")
+        >>> write_stored(filename, {"x": numpy.arange(5)}, {"order": 5})
+        >>> StoredModel(filename)["x"].tolist()
+        [0, 1, 2, 3, 4]
+    """
+    arrays = {name:numpy.ascontiguousarray(array) for name, array in arrays.items()}
+    for name, array in arrays.items():
+        if array.dtype == object:
+            raise TypeError("array %s has dtype object and cannot be stored" % name)
+        arrays[name] = array.astype(array.dtype.newbyteorder("<"), copy=False)
+
+    # the offsets depend on the header length, which depends on the offsets:
+    # reserve room for the header and grow it until it fits
+    reserved = _ALIGNMENT
+    while True:
+        layout = {}
+        offset = reserved
+        for name, array in sorted(arrays.items()):
+            layout[name] = {"dtype":array.dtype.str, "shape":list(array.shape),
+                            "offset":offset}
+            offset += array.nbytes + (-array.nbytes % _ALIGNMENT)
+        header = json.dumps({"meta":meta or {}, "arrays":layout},
+                            separators=(",", ":")).encode("utf-8")
+        if len(MAGIC) + 8 + len(header) <= reserved:
+            break
+        reserved = len(MAGIC) + 8 + len(header)
+        reserved += -reserved % _ALIGNMENT
+
+    partial = filename + ".part"
+    with open(partial, "wb") as f:
+        f.write(MAGIC + struct.pack("<Q", len(header)) + header)
+        for name, array in sorted(arrays.items()):
+            f.seek(layout[name]["offset"])
+            f.write(array.tobytes())
+        f.truncate(offset)
+    os.replace(partial, filename)
+
+
+def pack_gltf(instanced=(), merged=()):
+    """
+    Return the arrays of the instanced and merged meshes taken by
+    :func:`~cayley_export.write_glb`, named for :func:`write_stored`, and
+    the JSON-serializable layout with which :func:`unpack_gltf` restores
+    them.
+
+    EXAMPLES::
+
+        >>> spheres = {"name": "vertices", "mesh": (numpy.eye(3), [[0, 1, 2]]),
+        ...            "translation": numpy.zeros((2, 3)),
+        ...            "attributes": {"_VISIBLE": numpy.ones(2)}}
+        >>> arrays, layout = pack_gltf([spheres])
+        >>> for name in sorted(arrays):
+        ...     print(name)
+        gltf/instanced/0/_VISIBLE
+        gltf/instanced/0/points
+        gltf/instanced/0/translation
+        gltf/instanced/0/triangles
+        >>> unpack_gltf(arrays, layout)[0][0]["attributes"]["_VISIBLE"].tolist()
+        [1.0, 1.0]
+    """
+    arrays = {}
+    layout = {"instanced":[], "merged":[]}
+    for kind, specs in (("instanced", instanced), ("merged", merged)):
+        for k, spec in enumerate(specs):
+            prefix = "gltf/%s/%s/" % (kind, k)
+            arrays[prefix + "points"], arrays[prefix + "triangles"] = spec["mesh"]
+            fields = [field for field in ("translation", "rotation", "scale", "colors")
+                      if spec.get(field) is not None]
+            for field in fields:
+                arrays[prefix + field] = spec[field]
+            attributes = sorted(spec.get("attributes", {}))
+            for name in attributes:
+                arrays[prefix + name] = spec["attributes"][name]
+            layout[kind].append({"name":spec["name"], "fields":fields,
+                                 "attributes":attributes})
+    return arrays, layout
+
+
+def unpack_gltf(arrays, layout):
+    """
+    Return the lists of instanced and merged meshes packed by
+    :func:`pack_gltf`, reading their arrays from ``arrays``.
+    """
+    specs = {}
+    for kind, entries in layout.items():
+        specs[kind] = []
+        for k, entry in enumerate(entries):
+            prefix = "gltf/%s/%s/" % (kind, k)
+            spec = {"name":entry["name"],
+                    "mesh":(arrays[prefix + "points"], arrays[prefix + "triangles"]),
+                    "attributes":{name:arrays[prefix + name] for name in entry["attributes"]}}
+            for field in entry["fields"]:
+                spec[field] = arrays[prefix + field]
+            specs[kind].append(spec)
+    return specs["instanced"], specs["merged"]
+
+
+def read_header(filename):
+    """
+    Return the JSON header of the stored model ``filename``, without
+    mapping its arrays.
+    """
+    with open(filename, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a stored model" % filename)
+        length, = struct.unpack("<Q", f.read(8))
+        return json.loads(f.read(length).decode("utf-8"))
+
+
+class StoredModel(object):
+    """
+    A model stored by :func:`write_stored`, mapped read-only into memory.
+
+    Indexing by an array name gives a read-only numpy view of the mapping;
+    ``meta`` is the dictionary of model metadata. The main arrays written
+    by :meth:`ReflectionGroup3d.export_stored` are:
+
+    - ``"positions"`` -- the vertex positions
+
+    - ``"element_perms"`` -- the root permutation of every element
+
+    - ``"coset_table/<c>"`` -- the coset table of the ``c``-th reflection
+      class, and ``"edge_offsets"``, the ids of its first edge
+
+    - ``"vertex/<name>"``, ``"edge/<name>"`` -- the numeric, boolean and
+      color property columns
+
+    - ``"mesh/points"``, ``"mesh/triangles"`` -- the triangle mesh of
+      :meth:`ReflectionGroup3d.export_mesh`
+
+    - ``"gltf/..."`` -- the instanced and merged meshes of
+      :meth:`ReflectionGroup3d.export_gltf`, see :func:`pack_gltf`
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError("%s is not a stored model" % filename)
+        length, = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        start = len(MAGIC) + 8
+        header = json.loads(self._mmap[start:start + length].decode("utf-8"))
+        self.meta = header["meta"]
+        self._layout = header["arrays"]
+        self._arrays = {}
+
+    def __getitem__(self, name):
+        array = self._arrays.get(name)
+        if array is None:
+            if self._mmap is None:
+                raise ValueError("the stored model %s is closed" % self.filename)
+            spec = self._layout[name]
+            shape = tuple(spec["shape"])
+            array = numpy.frombuffer(self._mmap, dtype=spec["dtype"],
+                                     count=int(numpy.prod(shape)),
+                                     offset=spec["offset"]).reshape(shape)
+            self._arrays[name] = array
+        return array
+
+    def __contains__(self, name):
+        return name in self._layout
+
+    def names(self):
+        """
+        Return the sorted list of the names of the stored arrays.
+        """
+        return sorted(self._layout)
+
+    @property
+    def positions(self):
+        return self["positions"]
+
+    @property
+    def coset_tables(self):
+        """
+        The list of the coset tables, one per reflection class.
+        """
+        return [self["coset_table/%s" % c] for c in range(len(self["edge_offsets"]) - 1)]
+
+    @property
+    def mesh(self):
+        """
+        The pair ``(points, triangles)`` of the pre-tessellated mesh.
+        """
+        return self["mesh/points"], self["mesh/triangles"]
+
+    def export_mesh(self, output, fmt=None):
+        """
+        Write the stored mesh to ``output`` as by
+        :meth:`ReflectionGroup3d.export_mesh`, and return the number of
+        triangles written.
+        """
+        if fmt is None:
+            fmt = format_from_filename(output)
+        return write_mesh(output, [self.mesh], fmt)
+
+    def export_gltf(self, output):
+        """
+        Write the stored model to ``output`` as the binary glTF file of
+        :meth:`ReflectionGroup3d.export_gltf`, with its instanced spheres
+        and tubes, and return the number of bytes written.
+        """
+        if "gltf" not in self.meta:
+            raise ValueError("%s holds no glTF buffers" % self.filename)
+        return write_glb(output, *unpack_gltf(self, self.meta["gltf"]))
+
+    def close(self):
+        """
+        Release the mapping.
+
+        Arrays taken from the model hold on to it: they stay valid, and the
+        mapping is only unmapped once the last of them is deleted.
+
+        EXAMPLES::
+
+            >>> import os, tempfile
+            >>> filename = os.path.join(tempfile.mkdtemp(), "a.cayley")
+            >>> write_stored(filename, {"x": numpy.arange(3)})
+            >>> model = StoredModel(filename)
+            >>> x = model["x"]
+            >>> model.close()
+            >>> x.tolist()
+            [0, 1, 2]
+            >>> model["x"]  # doctest: +ELLIPSIS
+            Traceback (most recent call last):
+            ...
+            ValueError: the stored model ... is closed
+        """
+        self._arrays.clear()
+        try:
+            self._mmap.close()
+        except BufferError:
+            # numpy views of the mapping are still alive; it is unmapped
+            # when they are garbage collected
+            pass
+        self._mmap = None
+
+
+class ModelCatalog(object):
+    """
+    A directory of stored models, listed by name in its ``index.json``.
+
+    Models are opened on first use and kept open, so a process serving
+    many models maps each file once. The index maps every model name to its
+    file and header metadata; :meth:`reindex` rebuilds it from the files in
+    the directory, for example after a batch run wrote them in parallel.
+    Models are looked up by name, or with :meth:`find` by the job
+    specification they were built from.
+    """
+    INDEX = "index.json"
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._models = {}
+        try:
+            with open(os.path.join(directory, self.INDEX)) as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            self.index = {}
+        self._jobs = None
+
+    def __contains__(self, name):
+        return name in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def names(self):
+        return sorted(self.index)
+
+    def filename(self, name):
+        """
+        Return the path of the stored model ``name``.
+        """
+        return os.path.join(self.directory, self.index[name]["file"])
+
+    def find(self, spec):
+        """
+        Return the name of the model stored with the job specification
+        ``spec`` (see :func:`cayley_batch.job_spec`), or ``None`` if there
+        is none.
+        """
+        if self._jobs is None:
+            self._jobs = {json.dumps(entry["meta"]["job"]):name
+                          for name, entry in self.index.items() if "job" in entry["meta"]}
+        return self._jobs.get(json.dumps(spec))
+
+    def open(self, name):
+        """
+        Return the :class:`StoredModel` named ``name``.
+        """
+        model = self._models.get(name)
+        if model is None:
+            model = StoredModel(self.filename(name))
+            self._models[name] = model
+        return model
+
+    def model_bytes(self, name, fmt):
+        """
+        Return the model ``name`` exported in the format ``fmt``, one of
+        ``"stl"``, ``"obj"``, ``"3mf"`` or ``"glb"``.
+        """
+        buf = io.BytesIO()
+        if fmt == "glb":
+            self.open(name).export_gltf(buf)
+        else:
+            self.open(name).export_mesh(buf, fmt)
+        return buf.getvalue()
+
+    def reindex(self):
+        """
+        Rebuild the index from the stored models in the directory and
+        return the sorted list of their names.
+        """
+        index = {}
+        for entry in sorted(os.listdir(self.directory)):
+            if entry.endswith(EXTENSION):
+                index[entry[:-len(EXTENSION)]] = {"file":entry,
+                                                  "meta":read_header(os.path.join(self.directory, entry))["meta"]}
+        partial = os.path.join(self.directory, self.INDEX + ".part")
+        with open(partial, "w") as f:
+            json.dump(index, f, indent=1, sort_keys=True)
+        os.replace(partial, os.path.join(self.directory, self.INDEX))
+        self.index = index
+        self._jobs = None
+        return self.names()
+
+    def close(self):
+        for model in self._models.values():
+            model.close()
+        self._models.clear()
@@ -0,0 +1,396 @@
+"""
+Streaming writers for 3d printing file formats.
+
+Each writer takes an iterable of meshes ``(points, triangles)``, as produced
+by :mod:`cayley_mesh`, and writes them one at a time to a file or buffer, so
+a model is never held in memory as a single scene. Supported formats are
+binary STL, Wavefront OBJ and 3MF.
+
+For the web viewer, :func:`write_glb` writes binary glTF in which repeated
+primitives are stored once and instanced.
+
+This module only depends on numpy and the standard library.
+
+EXAMPLES::
+
+    >>> import io
+    >>> from cayley_mesh import polygon_prism
+    >>> triangle = polygon_prism([[0, 0, 0], [1, 0, 0], [0, 1, 0]], .1)
+    >>> buf = io.BytesIO()
+    >>> write_mesh(buf, [triangle, triangle], "stl")
+    16
+    >>> len(buf.getvalue())
+    884
+
+"""
+
+import json
+import struct
+import zipfile
+
+import numpy
+
+
+FORMATS = ("stl", "obj", "3mf")
+
+# approximate file size per triangle of a model, for byte budgets; OBJ and
+# 3MF files of spheres and tubes have about half as many points as triangles
+BYTES_PER_TRIANGLE = {"stl":50, "obj":36, "3mf":15}
+
+_STL_RECORD = numpy.dtype([("normal", "<f4", (3,)),
+                           ("vertices", "<f4", (3, 3)),
+                           ("attribute", "<u2")])
+
+
+def _open_output(output):
+    """
+    Return a binary file object for ``output`` and whether the caller has to
+    close it. ``output`` is either a filename or a writable binary file object.
+    """
+    if hasattr(output, "write"):
+        return output, False
+    return open(output, "wb"), True
+
+
+def format_from_filename(filename):
+    """
+    Return the format of ``filename`` from its extension.
+
+    EXAMPLES::
+
+        >>> format_from_filename("H3.STL")
+        'stl'
+        >>> format_from_filename("H3.ply")
+        Traceback (most recent call last):
+        ...
+        ValueError: unknown mesh format 'ply', should be one of stl, obj, 3mf
+    """
+    fmt = filename.rsplit(".", 1)[-1].lower()
+    if fmt not in FORMATS:
+        raise ValueError("unknown mesh format '%s', should be one of %s"
+                         % (fmt, ", ".join(FORMATS)))
+    return fmt
+
+
+def write_stl(output, meshes, triangle_count=None):
+    """
+    Write ``meshes`` to ``output`` as a binary STL file.
+
+    The triangle count in the STL header is patched in at the end, so
+    ``output`` has to be seekable unless ``triangle_count`` is given.
+
+    OUTPUT:
+
+    The number of triangles written.
+
+    EXAMPLES::
+
+        >>> import io
+        >>> from cayley_mesh import polygon_prism
+        >>> buf = io.BytesIO()
+        >>> write_stl(buf, [polygon_prism([[0, 0, 0], [1, 0, 0], [0, 1, 0]], .1)])
+        8
+        >>> struct.unpack("<I", buf.getvalue()[80:84])
+        (8,)
+    """
+    f, close = _open_output(output)
+    try:
+        start = f.tell() if triangle_count is None else None
+        f.write(b"binary STL written by cayley_export".ljust(80, b" "))
+        f.write(struct.pack("<I", triangle_count or 0))
+        count = 0
+        for points, triangles in meshes:
+            corners = numpy.asarray(points, dtype=float)[triangles]
+            normals = numpy.cross(corners[:, 1] - corners[:, 0],
+                                  corners[:, 2] - corners[:, 0])
+            lengths = numpy.linalg.norm(normals, axis=1)
+            normals /= numpy.where(lengths > 0, lengths, 1)[:, None]
+            records = numpy.zeros(len(triangles), dtype=_STL_RECORD)
+            records["normal"] = normals
+            records["vertices"] = corners
+            f.write(records.tobytes())
+            count += len(triangles)
+        if triangle_count is None:
+            end = f.tell()
+            f.seek(start + 80)
+            f.write(struct.pack("<I", count))
+            f.seek(end)
+        elif triangle_count != count:
+            raise ValueError("expected %s triangles, got %s" % (triangle_count, count))
+    finally:
+        if close:
+            f.close()
+    return count
+
+
+def write_obj(output, meshes):
+    """
+    Write ``meshes`` to ``output`` as a Wavefront OBJ file, each mesh as
+    its own group.
+
+    OUTPUT:
+
+    The number of triangles written.
+
+    EXAMPLES::
+
+        >>> import io
+        >>> from cayley_mesh import polygon_prism
+        >>> buf = io.BytesIO()
+        >>> write_obj(buf, [polygon_prism([[0, 0, 0], [1, 0, 0], [0, 1, 0]], .1)])
+        8
+        >>> print(buf.getvalue().decode().splitlines()[1])
+        v 0.000000 0.000000 0.050000
+    """
+    f, close = _open_output(output)
+    try:
+        offset = 1
+        count = 0
+        for n, (points, triangles) in enumerate(meshes):
+            points = numpy.asarray(points, dtype=float)
+            lines = ["g mesh_%s\n" % n,
+                     ("v %.6f %.6f %.6f\n"*len(points)) % tuple(points.ravel()),
+                     ("f %d %d %d\n"*len(triangles)) % tuple((triangles + offset).ravel())]
+            f.write("".join(lines).encode("ascii"))
+            offset += len(points)
+            count += len(triangles)
+    finally:
+        if close:
+            f.close()
+    return count
+
+
+_3MF_CONTENT_TYPES = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+
+_3MF_RELS = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+<Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+
+def write_3mf(output, meshes):
+    """
+    Write ``meshes`` to ``output`` as a 3MF package, each mesh as its own
+    object. The model part is compressed while it is written, one mesh at
+    a time.
+
+    OUTPUT:
+
+    The number of triangles written.
+
+    EXAMPLES::
+
+        >>> import io
+        >>> from cayley_mesh import polygon_prism
+        >>> buf = io.BytesIO()
+        >>> write_3mf(buf, [polygon_prism([[0, 0, 0], [1, 0, 0], [0, 1, 0]], .1)])
+        8
+        >>> sorted(zipfile.ZipFile(buf).namelist())
+        ['3D/3dmodel.model', '[Content_Types].xml', '_rels/.rels']
+    """
+    f, close = _open_output(output)
+    try:
+        with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED) as package:
+            package.writestr("[Content_Types].xml", _3MF_CONTENT_TYPES)
+            package.writestr("_rels/.rels", _3MF_RELS)
+            with package.open("3D/3dmodel.model", "w") as model:
+                model.write(b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                            b'<model unit="millimeter" xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">\n'
+                            b'<resources>\n')
+                count = 0
+                n = 0
+                for n, (points, triangles) in enumerate(meshes, 1):
+                    points = numpy.asarray(points, dtype=float)
+                    lines = ['<object id="%s" type="model"><mesh><vertices>\n' % n,
+                             ('<vertex x="%.6f" y="%.6f" z="%.6f"/>\n'*len(points))
+                             % tuple(points.ravel()),
+                             '</vertices><triangles>\n',
+                             ('<triangle v1="%d" v2="%d" v3="%d"/>\n'*len(triangles))
+                             % tuple(triangles.ravel()),
+                             '</triangles></mesh></object>\n']
+                    model.write("".join(lines).encode("ascii"))
+                    count += len(triangles)
+                model.write(b"</resources>\n<build>\n")
+                model.write("".join('<item objectid="%s"/>\n' % i
+                                    for i in range(1, n + 1)).encode("ascii"))
+                model.write(b"</build>\n</model>\n")
+    finally:
+        if close:
+            f.close()
+    return count
+
+
+def write_mesh(output, meshes, fmt):
+    """
+    Write ``meshes`` to ``output`` in the format ``fmt``, one of ``FORMATS``.
+
+    OUTPUT:
+
+    The number of triangles written.
+    """
+    if fmt == "stl":
+        return write_stl(output, meshes)
+    elif fmt == "obj":
+        return write_obj(output, meshes)
+    elif fmt == "3mf":
+        return write_3mf(output, meshes)
+    raise ValueError("unknown mesh format '%s', should be one of %s"
+                     % (fmt, ", ".join(FORMATS)))
+
+
+def quaternions_from_y(directions):
+    """
+    Return, as ``(x, y, z, w)`` rows, the unit quaternions of rotations
+    taking the y axis to the directions of the rows of ``directions``.
+
+    EXAMPLES::
+
+        >>> q = quaternions_from_y([[0, 1, 0], [0, 0, 2], [0, -1, 0]])
+        >>> (q.round(6) + 0).tolist()
+        [[0.0, 0.0, 0.0, 1.0], [0.707107, 0.0, 0.0, 0.707107], [1.0, 0.0, 0.0, 0.0]]
+    """
+    directions = numpy.asarray(directions, dtype=float)
+    lengths = numpy.linalg.norm(directions, axis=1)
+    d = directions/numpy.where(lengths > 0, lengths, 1)[:, None]
+    # q = (y x d, 1 + y.d), normalized; opposite directions turn about x
+    q = numpy.column_stack((d[:, 2], numpy.zeros(len(d)), -d[:, 0], 1 + d[:, 1]))
+    opposite = q[:, 3] < 1e-12
+    q[opposite] = [1, 0, 0, 0]
+    return q/numpy.linalg.norm(q, axis=1)[:, None]
+
+
+class _GLBBuffer(object):
+    """
+    The binary buffer of a glTF file with its buffer views and accessors.
+    """
+    _COMPONENTS = {numpy.dtype("<f4"):5126, numpy.dtype("<u4"):5125}
+    _TYPES = {1:"SCALAR", 3:"VEC3", 4:"VEC4"}
+
+    def __init__(self):
+        self.chunks = []
+        self.length = 0
+        self.views = []
+        self.accessors = []
+
+    def add(self, array, dtype="<f4", target=None, bounds=False):
+        """
+        Append ``array`` to the buffer and return the index of its accessor.
+        """
+        array = numpy.ascontiguousarray(array, dtype=dtype)
+        data = array.tobytes()
+        view = {"buffer":0, "byteOffset":self.length, "byteLength":len(data)}
+        if target is not None:
+            view["target"] = target
+        self.views.append(view)
+        self.chunks.append(data + b"\0"*(-len(data) % 4))
+        self.length += len(data) + (-len(data) % 4)
+
+        width = array.shape[1] if array.ndim > 1 else 1
+        accessor = {"bufferView":len(self.views) - 1,
+                    "componentType":self._COMPONENTS[array.dtype],
+                    "count":len(array),
+                    "type":self._TYPES[width]}
+        if bounds:
+            accessor["min"] = array.min(axis=0).tolist()
+            accessor["max"] = array.max(axis=0).tolist()
+        self.accessors.append(accessor)
+        return len(self.accessors) - 1
+
+    def add_mesh(self, points, triangles, colors=None):
+        """
+        Append an indexed triangle mesh and return its glTF primitive.
+        """
+        attributes = {"POSITION":self.add(points, target=34962, bounds=True)}
+        if colors is not None:
+            attributes["COLOR_0"] = self.add(colors, target=34962)
+        return {"attributes":attributes,
+                "indices":self.add(numpy.asarray(triangles).ravel(), "<u4", target=34963)}
+
+
+def write_glb(output, instanced=(), merged=()):
+    """
+    Write a binary glTF (GLB) file for the web viewer.
+
+    Instanced meshes are stored once and drawn at every instance through the
+    ``EXT_mesh_gpu_instancing`` extension; merged meshes are stored as one
+    indexed buffer with per-point colors.
+
+    INPUT:
+
+    - ``output`` -- a filename or a writable binary file object
+
+    - ``instanced`` -- a list of dictionaries with keys ``"name"``,
+      ``"mesh"`` (a pair ``(points, triangles)``), ``"translation"`` (an
+      ``(n, 3)`` array), optionally ``"rotation"`` (``(n, 4)`` quaternions)
+      and ``"scale"`` (``(n, 3)``), and ``"attributes"``, a dictionary of
+      per-instance ``(n,)`` or ``(n, 3)`` arrays whose names start with an
+      underscore
+
+    - ``merged`` -- a list of dictionaries with keys ``"name"``, ``"mesh"``
+      and ``"colors"``, an array of RGB colors, one per point of the mesh
+
+    OUTPUT:
+
+    The number of bytes written.
+
+    EXAMPLES::
+
+        >>> import io
+        >>> from cayley_mesh import sphere_mesh
+        >>> buf = io.BytesIO()
+        >>> spheres = {"name": "vertices", "mesh": sphere_mesh([[0, 0, 0]], [1]),
+        ...            "translation": numpy.eye(3), "scale": numpy.ones((3, 3)),
+        ...            "attributes": {"_COLOR_0": numpy.eye(3)}}
+        >>> write_glb(buf, [spheres]) == len(buf.getvalue())
+        True
+        >>> buf.getvalue()[:4]
+        b'glTF'
+    """
+    buf = _GLBBuffer()
+    meshes = []
+    nodes = []
+    for spec in instanced:
+        meshes.append({"name":spec["name"], "primitives":[buf.add_mesh(*spec["mesh"])]})
+        attributes = {"TRANSLATION":buf.add(spec["translation"])}
+        if spec.get("rotation") is not None:
+            attributes["ROTATION"] = buf.add(spec["rotation"])
+        if spec.get("scale") is not None:
+            attributes["SCALE"] = buf.add(spec["scale"])
+        for name, values in spec.get("attributes", {}).items():
+            attributes[name] = buf.add(values)
+        nodes.append({"name":spec["name"], "mesh":len(meshes) - 1,
+                      "extensions":{"EXT_mesh_gpu_instancing":{"attributes":attributes}}})
+    for spec in merged:
+        points, triangles = spec["mesh"]
+        meshes.append({"name":spec["name"],
+                       "primitives":[buf.add_mesh(points, triangles, spec.get("colors"))]})
+        nodes.append({"name":spec["name"], "mesh":len(meshes) - 1})
+
+    document = {"asset":{"version":"2.0", "generator":"cayley_export"},
+                "extensionsUsed":["EXT_mesh_gpu_instancing"],
+                "scene":0, "scenes":[{"nodes":list(range(len(nodes)))}],
+                "nodes":nodes, "meshes":meshes,
+                "buffers":[{"byteLength":buf.length}],
+                "bufferViews":buf.views, "accessors":buf.accessors}
+    document = json.dumps(document, separators=(",", ":")).encode("ascii")
+    document += b" "*(-len(document) % 4)
+
+    total = 12 + 8 + len(document) + 8 + buf.length
+    f, close = _open_output(output)
+    try:
+        f.write(struct.pack("<4sII", b"glTF", 2, total))
+        f.write(struct.pack("<I4s", len(document), b"JSON"))
+        f.write(document)
+        f.write(struct.pack("<I4s", buf.length, b"BIN\0"))
+        for chunk in buf.chunks:
+            f.write(chunk)
+    finally:
+        if close:
+            f.close()
+    return total
@@ -0,0 +1,402 @@
+"""
+Triangle mesh generation for rigid 3d Cayley graph models.
+
+The functions in this module turn the vertex and edge tables of a
+:class:`ReflectionGroup3d` into plain triangle meshes: spheres for the
+vertices, tubes for the order 2 edges and thickened polygons for the higher
+order edges. Every function works on a whole batch of primitives at once and
+returns a pair ``(points, triangles)`` of numpy arrays, where ``points`` has
+shape ``(V, 3)`` and ``triangles`` is an integer array of shape ``(F, 3)``
+of indices into ``points``, with counter-clockwise (outward) orientation.
+
+The resolution of the spheres and tubes is set by a :class:`LevelOfDetail`,
+chosen by :func:`level_of_detail` from a quality tier and a triangle budget.
+
+This module only depends on numpy, so meshes can be generated and written
+without a Sage session.
+
+EXAMPLES::
+
+    >>> import numpy
+    >>> from cayley_mesh import sphere_mesh
+    >>> points, triangles = sphere_mesh(numpy.zeros((2, 3)), numpy.ones(2))
+    >>> points.shape, triangles.shape
+    ((84, 3), (160, 3))
+
+"""
+
+from collections import namedtuple
+
+import numpy
+
+
+def _unit_sphere(segments=8, rings=6):
+    """
+    Return the points and triangles of a UV sphere of radius 1.
+
+    The sphere has ``segments`` points around each of its ``rings - 1``
+    circles of latitude, plus the two poles.
+
+    EXAMPLES::
+
+        >>> points, triangles = _unit_sphere(4, 3)
+        >>> points.shape, triangles.shape
+        ((10, 3), (16, 3))
+        >>> bool(numpy.allclose(numpy.linalg.norm(points, axis=1), 1))
+        True
+    """
+    theta = numpy.linspace(0, numpy.pi, rings + 1)[1:-1]
+    phi = numpy.linspace(0, 2*numpy.pi, segments, endpoint=False)
+    ring_points = numpy.stack((numpy.outer(numpy.sin(theta), numpy.cos(phi)),
+                               numpy.outer(numpy.sin(theta), numpy.sin(phi)),
+                               numpy.outer(numpy.cos(theta), numpy.ones(segments))),
+                              axis=-1).reshape(-1, 3)
+    points = numpy.vstack(([0, 0, 1], ring_points, [0, 0, -1]))
+
+    top, bottom = 0, len(points) - 1
+    j = numpy.arange(segments)
+    k = (j + 1) % segments
+    triangles = [numpy.column_stack((numpy.full(segments, top), 1 + j, 1 + k))]
+    for ring in range(rings - 2):
+        a = 1 + ring*segments + j
+        b = 1 + ring*segments + k
+        c = a + segments
+        d = b + segments
+        triangles.append(numpy.column_stack((a, c, d)))
+        triangles.append(numpy.column_stack((a, d, b)))
+    last = 1 + (rings - 2)*segments
+    triangles.append(numpy.column_stack((last + j, numpy.full(segments, bottom), last + k)))
+    return points, numpy.vstack(triangles)
+
+
+def _replicate(points, triangles, count):
+    """
+    Return the triangles of ``count`` copies of a template mesh whose copies
+    are stored one after the other, each with ``len(points)`` points.
+    """
+    offsets = (numpy.arange(count)*len(points))[:, None, None]
+    return (triangles[None, :, :] + offsets).reshape(-1, 3)
+
+
+def sphere_mesh(centers, radii, segments=8, rings=6):
+    """
+    Return one sphere mesh for each center.
+
+    INPUT:
+
+    - ``centers`` -- an array of shape ``(n, 3)``
+
+    - ``radii`` -- an array of ``n`` radii
+
+    - ``segments``, ``rings`` -- the resolution of each sphere
+
+    OUTPUT:
+
+    A pair ``(points, triangles)``.
+
+    EXAMPLES::
+
+        >>> points, triangles = sphere_mesh([[0, 0, 0], [5, 0, 0]], [1, 2], 4, 3)
+        >>> points.shape, triangles.shape
+        ((20, 3), (32, 3))
+        >>> float(numpy.linalg.norm(points[10:] - [5, 0, 0], axis=1).max())
+        2.0
+    """
+    centers = numpy.asarray(centers, dtype=float).reshape(-1, 3)
+    radii = numpy.asarray(radii, dtype=float).reshape(-1)
+    unit_points, unit_triangles = _unit_sphere(segments, rings)
+    points = centers[:, None, :] + radii[:, None, None]*unit_points[None, :, :]
+    return points.reshape(-1, 3), _replicate(unit_points, unit_triangles, len(centers))
+
+
+def _frames(directions):
+    """
+    Return two arrays of unit vectors which, together with ``directions``,
+    form an orthogonal frame at each row.
+    """
+    lengths = numpy.linalg.norm(directions, axis=1)
+    axes = directions/numpy.where(lengths > 0, lengths, 1)[:, None]
+    helper = numpy.zeros_like(axes)
+    helper[numpy.arange(len(axes)), numpy.argmin(numpy.abs(axes), axis=1)] = 1
+    u = numpy.cross(axes, helper)
+    u /= numpy.linalg.norm(u, axis=1)[:, None]
+    v = numpy.cross(axes, u)
+    return u, v
+
+
+def tube_mesh(starts, ends, radii, segments=8):
+    """
+    Return one closed cylinder mesh for each segment ``[starts[i], ends[i]]``.
+
+    INPUT:
+
+    - ``starts``, ``ends`` -- arrays of shape ``(n, 3)``
+
+    - ``radii`` -- an array of ``n`` radii
+
+    - ``segments`` -- the number of sides of each cylinder
+
+    OUTPUT:
+
+    A pair ``(points, triangles)``.
+
+    EXAMPLES::
+
+        >>> points, triangles = tube_mesh([[0, 0, 0]], [[0, 0, 4]], [1], 4)
+        >>> points.shape, triangles.shape
+        ((10, 3), (16, 3))
+        >>> sorted(set(points[:, 2].tolist()))
+        [0.0, 4.0]
+    """
+    starts = numpy.asarray(starts, dtype=float).reshape(-1, 3)
+    ends = numpy.asarray(ends, dtype=float).reshape(-1, 3)
+    radii = numpy.asarray(radii, dtype=float).reshape(-1)
+    u, v = _frames(ends - starts)
+    phi = numpy.linspace(0, 2*numpy.pi, segments, endpoint=False)
+    ring = (numpy.cos(phi)[None, :, None]*u[:, None, :] +
+            numpy.sin(phi)[None, :, None]*v[:, None, :])*radii[:, None, None]
+    # per tube: bottom ring, top ring, bottom center, top center
+    points = numpy.concatenate((starts[:, None, :] + ring,
+                                ends[:, None, :] + ring,
+                                starts[:, None, :],
+                                ends[:, None, :]), axis=1)
+
+    j = numpy.arange(segments)
+    k = (j + 1) % segments
+    bottom_center = numpy.full(segments, 2*segments)
+    top_center = bottom_center + 1
+    template = numpy.vstack((numpy.column_stack((j, k + segments, j + segments)),
+                             numpy.column_stack((j, k, k + segments)),
+                             numpy.column_stack((bottom_center, k, j)),
+                             numpy.column_stack((top_center, j + segments, k + segments))))
+    return (points.reshape(-1, 3),
+            _replicate(numpy.empty((2*segments + 2, 3)), template, len(starts)))
+
+
+def prism_triangles(k):
+    """
+    Return the triangles of a prism over a ``k``-gon whose points are the
+    ``k`` corners of its top face followed by those of its bottom face.
+    """
+    fan = numpy.arange(1, k - 1)
+    j = numpy.arange(k)
+    l = (j + 1) % k
+    return numpy.vstack((numpy.column_stack((numpy.zeros(k - 2, dtype=int), fan, fan + 1)),
+                         numpy.column_stack((numpy.full(k - 2, k), fan + 1 + k, fan + k)),
+                         numpy.column_stack((j, j + k, l + k)),
+                         numpy.column_stack((j, l + k, l))))
+
+
+def polygon_normals(polygons):
+    """
+    Return the unit normals of a batch of planar polygons.
+
+    The normal of each polygon is taken from its first three corners, so it
+    points to the side from which they turn counter-clockwise.
+
+    EXAMPLES::
+
+        >>> polygon_normals([[[0, 0, 0], [1, 0, 0], [0, 1, 0]]]).tolist()
+        [[0.0, 0.0, 1.0]]
+    """
+    polygons = numpy.asarray(polygons, dtype=float)
+    normals = numpy.cross(polygons[:, 1] - polygons[:, 0],
+                          polygons[:, 2] - polygons[:, 0])
+    lengths = numpy.linalg.norm(normals, axis=1)
+    return normals/numpy.where(lengths > 0, lengths, 1)[:, None]
+
+
+def extrude_polygons(polygons, thickness):
+    """
+    Return the meshes of a batch of planar polygons, each thickened along its
+    normal into a prism.
+
+    All polygons must have the same number of corners. The prisms are
+    computed analytically in one pass: each has the corners of the polygon
+    moved by half the thickness to either side as points, the two polygon
+    faces as triangle fans, and two triangles per side.
+
+    INPUT:
+
+    - ``polygons`` -- an array of shape ``(m, k, 3)`` listing the corners of
+      ``m`` convex planar ``k``-gons in cyclic order
+
+    - ``thickness`` -- a number, or an array of ``m`` numbers, the distance
+      between the two faces of each prism
+
+    OUTPUT:
+
+    A pair ``(points, triangles)``; the ``2k`` points and ``4k - 4``
+    triangles of the ``i``-th prism come ``i``-th in their arrays.
+
+    EXAMPLES::
+
+        >>> squares = [[[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]],
+        ...            [[0, 0, 5], [0, 1, 5], [1, 1, 5], [1, 0, 5]]]
+        >>> points, triangles = extrude_polygons(squares, [.5, 1])
+        >>> points.shape, triangles.shape
+        ((16, 3), (24, 3))
+        >>> sorted(set(points[:, 2].tolist()))
+        [-0.25, 0.25, 4.5, 5.5]
+    """
+    polygons = numpy.asarray(polygons, dtype=float)
+    m, k = polygons.shape[:2]
+    thickness = numpy.broadcast_to(numpy.asarray(thickness, dtype=float), (m,))
+    offsets = (.5*thickness)[:, None]*polygon_normals(polygons)
+    points = numpy.concatenate((polygons + offsets[:, None, :],
+                                polygons - offsets[:, None, :]), axis=1)
+    template = prism_triangles(k)
+    return points.reshape(-1, 3), _replicate(numpy.empty((2*k, 3)), template, m)
+
+
+def polygon_prism(polygon, thickness):
+    """
+    Return the mesh of a planar polygon thickened along its normal.
+
+    This is :func:`extrude_polygons` for a single polygon.
+
+    INPUT:
+
+    - ``polygon`` -- an array of shape ``(k, 3)`` listing the corners of a
+      convex planar polygon in cyclic order
+
+    - ``thickness`` -- the distance between the two faces of the prism
+
+    OUTPUT:
+
+    A pair ``(points, triangles)``.
+
+    EXAMPLES::
+
+        >>> square = [[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]]
+        >>> points, triangles = polygon_prism(square, .5)
+        >>> points.shape, triangles.shape
+        ((8, 3), (12, 3))
+        >>> sorted(set(points[:, 2].tolist()))
+        [-0.25, 0.25]
+    """
+    return extrude_polygons(numpy.asarray(polygon, dtype=float)[None], thickness)
+
+
+def merge_meshes(meshes):
+    """
+    Return a single mesh containing all the meshes of the iterable ``meshes``.
+
+    EXAMPLES::
+
+        >>> a = polygon_prism([[0, 0, 0], [1, 0, 0], [0, 1, 0]], .1)
+        >>> points, triangles = merge_meshes([a, a])
+        >>> points.shape, triangles.shape, int(triangles.max())
+        ((12, 3), (16, 3), 11)
+    """
+    all_points = []
+    all_triangles = []
+    offset = 0
+    for points, triangles in meshes:
+        all_points.append(points)
+        all_triangles.append(triangles + offset)
+        offset += len(points)
+    if not all_points:
+        return numpy.empty((0, 3)), numpy.empty((0, 3), dtype=int)
+    return numpy.vstack(all_points), numpy.vstack(all_triangles)
+
+
+# the resolution of the vertex spheres, of the order 2 edge tubes and of the
+# tubes along polygon sides
+LevelOfDetail = namedtuple("LevelOfDetail", ["sphere_segments", "sphere_rings",
+                                             "tube_segments", "boundary_segments"])
+
+QUALITY_TIERS = {"print":LevelOfDetail(8, 6, 8, 8),
+                 "preview":LevelOfDetail(6, 4, 6, 4),
+                 "thumbnail":LevelOfDetail(4, 3, 3, 3)}
+
+# the resolutions level_of_detail steps down through, finest first
+_SPHERE_LEVELS = ((8, 6), (7, 5), (6, 4), (5, 3), (4, 3))
+_TUBE_LEVELS = (8, 7, 6, 5, 4, 3)
+
+
+def detail_triangles(detail, spheres=0, tubes=0, sides=0, fixed=0):
+    """
+    Return the number of triangles of a model meshed at the level of detail
+    ``detail``.
+
+    INPUT:
+
+    - ``spheres``, ``tubes``, ``sides`` -- the numbers of vertex spheres, of
+      order 2 edge tubes and of tubes along polygon sides
+
+    - ``fixed`` -- the number of triangles that do not depend on the level
+      of detail, those of the thickened polygons
+
+    EXAMPLES::
+
+        >>> detail_triangles(QUALITY_TIERS["print"], spheres=24, tubes=72)
+        4224
+    """
+    segments, rings = detail.sphere_segments, detail.sphere_rings
+    return (2*segments*(rings - 1)*spheres + 4*detail.tube_segments*tubes +
+            4*detail.boundary_segments*sides + fixed)
+
+
+def level_of_detail(quality="print", max_triangles=None, spheres=0, tubes=0,
+                    sides=0, fixed=0):
+    """
+    Return the :class:`LevelOfDetail` of the quality tier ``quality``,
+    coarsened until the model fits in ``max_triangles`` triangles.
+
+    The model has ``spheres`` vertex spheres, ``tubes`` order 2 edge tubes,
+    ``sides`` tubes along polygon sides and ``fixed`` other triangles, see
+    :func:`detail_triangles`. While it is over budget, the kind of primitive
+    whose next coarser resolution saves the most triangles is coarsened.
+    If the model is over budget even at the coarsest resolutions, these
+    are returned.
+
+    INPUT:
+
+    - ``quality`` -- one of ``"print"``, ``"preview"`` or ``"thumbnail"``,
+      the finest level of detail used, see ``QUALITY_TIERS``
+
+    - ``max_triangles`` -- the triangle budget, or ``None`` for no budget
+
+    EXAMPLES::
+
+        >>> level_of_detail("preview")
+        LevelOfDetail(sphere_segments=6, sphere_rings=4, tube_segments=6, boundary_segments=4)
+        >>> detail = level_of_detail("print", 3000, spheres=24, tubes=72)
+        >>> detail, detail_triangles(detail, spheres=24, tubes=72)
+        (LevelOfDetail(sphere_segments=5, sphere_rings=3, tube_segments=8, boundary_segments=8), 2784)
+        >>> counts = dict(spheres=24, tubes=72, sides=12)
+        >>> level_of_detail("print", 10, **counts) == QUALITY_TIERS["thumbnail"]
+        True
+        >>> level_of_detail("draft")
+        Traceback (most recent call last):
+        ...
+        ValueError: unknown quality 'draft', should be one of print, preview, thumbnail
+    """
+    if quality not in QUALITY_TIERS:
+        raise ValueError("unknown quality '%s', should be one of %s"
+                         % (quality, ", ".join(QUALITY_TIERS)))
+    detail = QUALITY_TIERS[quality]
+    if max_triangles is None:
+        return detail
+    levels = [_SPHERE_LEVELS.index((detail.sphere_segments, detail.sphere_rings)),
+              _TUBE_LEVELS.index(detail.tube_segments),
+              _TUBE_LEVELS.index(detail.boundary_segments)]
+
+    def at(levels):
+        return LevelOfDetail(*(_SPHERE_LEVELS[levels[0]] +
+                               (_TUBE_LEVELS[levels[1]], _TUBE_LEVELS[levels[2]])))
+
+    counts = dict(spheres=spheres, tubes=tubes, sides=sides, fixed=fixed)
+    while detail_triangles(at(levels), **counts) > max_triangles:
+        savings = []
+        for kind, ladder in enumerate((_SPHERE_LEVELS, _TUBE_LEVELS, _TUBE_LEVELS)):
+            if levels[kind] + 1 < len(ladder):
+                coarser = list(levels)
+                coarser[kind] += 1
+                savings.append((detail_triangles(at(levels), **counts) -
+                                detail_triangles(at(coarser), **counts), -kind))
+        if not savings or max(savings)[0] <= 0:
+            break
+        levels[-max(savings)[1]] += 1
+    return at(levels)
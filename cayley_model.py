@@ -31,15 +31,359 @@ if you don't want to try to interactively debug errors.
 
 """
 
+from sage.combinat.root_system.reflection_group_complex import ComplexReflectionGroup
+from sage.misc.lazy_attribute import lazy_attribute
 from sage.structure.sage_object import SageObject
-from random import randint, seed
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
+from functools import wraps
+import itertools
+from random import random, seed
 from time import time
 import warnings
 
+import numpy
+
+from cayley_catalog import pack_gltf, write_stored
+from cayley_export import (BYTES_PER_TRIANGLE, format_from_filename,
+                           quaternions_from_y, write_glb, write_mesh)
+from cayley_mesh import (QUALITY_TIERS, extrude_polygons, level_of_detail,
+                         merge_meshes, prism_triangles, sphere_mesh, tube_mesh)
+from cayley_projection import Projection, rotated_planes
+from cayley_spatial import (candidate_pairs, segment_distances,
+                            segments_cross_triangles, share_entries)
+
+try:
+    from collections.abc import Mapping, MutableMapping
+except ImportError:
+    from collections import Mapping, MutableMapping
+
+
+def _fill_column(column, value, ids=slice(None)):
+    """
+    Set ``column[ids]`` to ``value``, treating tuples (such as RGB colors)
+    in object columns as a single value rather than as a sequence.
+
+    ``value`` may also be a numpy array with one entry (or row) for each of
+    the selected rows.
+    """
+    if isinstance(value, numpy.ndarray):
+        if column.dtype == object and value.ndim > 1:
+            boxed = numpy.empty(len(value), dtype=object)
+            boxed[:] = [tuple(row) for row in value.tolist()]
+            value = boxed
+        column[ids] = value
+    elif column.dtype == object and not isinstance(ids, (int, numpy.integer)):
+        boxed = numpy.empty(1, dtype=object)
+        boxed[0] = value
+        column[ids] = boxed
+    else:
+        column[ids] = value
+
+
+def _color_value(value):
+    """
+    Return the color ``value`` as stored in the color columns: a color name
+    or tuple is passed through Sage's ``rgbcolor``, giving an RGB tuple in
+    ``[0, 1]``, and an array of colors is converted row by row.
+
+    EXAMPLES:
+
+        sage: _color_value("red"), _color_value((0, 1, 0.5))
+        ((1.0, 0.0, 0.0), (0.0, 1.0, 0.5))
+    """
+    if isinstance(value, numpy.ndarray):
+        return numpy.array([rgbcolor(tuple(row)) for row in value.tolist()])
+    return rgbcolor(value)
+
+
+def _rgb_colors(colors):
+    """
+    Return the ``(n, 3)`` array of RGB values in ``[0, 1]`` of the colors in
+    ``colors``, which are color names or RGB tuples, read as by Sage's
+    ``rgbcolor`` (see :func:`_color_value`).
+    """
+    converted = {}
+    rgb = numpy.empty((len(colors), 3))
+    for i, color in enumerate(colors):
+        if not isinstance(color, str):
+            color = tuple(color)
+        if color not in converted:
+            converted[color] = rgbcolor(color)
+        rgb[i] = converted[color]
+    return rgb
+
+
+def _tube_graphics(starts, ends, radius, segments, **kwds):
+    """
+    Return the tubes along the segments ``[starts[i], ends[i]]`` as a single
+    Sage triangle mesh with ``segments`` sides per tube.
+    """
+    points, triangles = tube_mesh(starts, ends, numpy.full(len(starts), radius), segments)
+    return sage.plot.plot3d.index_face_set.IndexFaceSet(triangles.tolist(),
+                                                         points.tolist(), **kwds)
+
+
+class _PropertyColumn(MutableMapping):
+    """
+    Dictionary view of one property column of a :class:`_PropertyTable`.
+
+    Keys are the table's keys (group elements or edge tuples); values are
+    read from and written to the underlying numpy array. The set of keys
+    is fixed by the table, so keys cannot be added or deleted.
+    """
+    def __init__(self, table, column):
+        self._table = table
+        self.column = column
+
+    def __getitem__(self, key):
+        value = self.column[self._table.index[key]]
+        if self.column.ndim > 1:
+            return tuple(value.tolist())
+        if self.column.dtype != object:
+            return value.item()
+        return value
+
+    def __setitem__(self, key, value):
+        i = self._table.index[key]
+        if self.column.ndim > 1:
+            self.column[i] = value
+        else:
+            _fill_column(self.column, value, i)
+        self._table.dirty[i] = True
+
+    def __delitem__(self, key):
+        raise TypeError("vertices and edges of the model cannot be removed")
+
+    def __iter__(self):
+        return iter(self._table.row_keys)
+
+    def __len__(self):
+        return len(self._table.row_keys)
+
+
+class _PropertyTable(Mapping):
+    """
+    Columnar storage for the properties of the vertices or edges of a model.
+
+    Rows are identified by integer ids; ``row_keys[i]`` is the group element
+    (or edge tuple) with id ``i`` and ``index`` is the inverse mapping.
+    Each property is a single numpy array with one row per id: numbers and
+    booleans are stored as float64 and bool, everything else as objects.
+
+    Indexing by a property name gives a :class:`_PropertyColumn`, so that
+    ``table["color"][g]`` reads and writes like the former dict of dicts.
+    Assigning a dictionary to a property name overwrites the column entries
+    for its keys.
+
+    The boolean array ``dirty`` flags the rows changed since their graphics
+    were last built; writes through the views and :meth:`fill` set it, and
+    :meth:`ReflectionGroup3d.plot3d` clears it.
+    """
+    def __init__(self, row_keys, index):
+        self.row_keys = row_keys
+        self.index = index
+        self.columns = {}
+        self.dirty = numpy.ones(len(row_keys), dtype=bool)
+
+    def add_column(self, name, default=None, column=None):
+        """
+        Add the property ``name``, either from an existing array ``column``
+        or filled with ``default``.
+        """
+        if column is None:
+            if isinstance(default, bool):
+                dtype = bool
+            elif isinstance(default, (int, float)):
+                dtype = float
+            else:
+                dtype = object
+            column = numpy.empty(len(self.row_keys), dtype=dtype)
+            _fill_column(column, default)
+        self.columns[name] = column
+
+    def fill(self, name, value, ids=slice(None)):
+        """
+        Set the property ``name`` of the rows ``ids`` (all rows by default)
+        to ``value`` and mark them dirty.
+        """
+        _fill_column(self.columns[name], value, ids)
+        self.dirty[ids] = True
+
+    def __getitem__(self, name):
+        return _PropertyColumn(self, self.columns[name])
+
+    def __setitem__(self, name, values):
+        view = self[name]
+        for key, value in values.items():
+            view[key] = value
+
+    def __iter__(self):
+        return iter(self.columns)
+
+    def __len__(self):
+        return len(self.columns)
+
+
+class _GroupDataCache(object):
+    """
+    Process-wide LRU cache of the data a model derives from its group alone.
+
+    Entries are keyed by the group type (its repr) and hold the element
+    enumeration, element matrices, reflection classes, coset table and edge
+    index of :class:`ReflectionGroup3d`. None of these depend on the base
+    point or projection plane, so models of the same group share them. At
+    most ``maxsize`` groups are kept; the least recently used is evicted.
+
+    EXAMPLES:
+
+        sage: group_data_cache.clear()
+        sage: W = ReflectionGroup(["A",2])
+        sage: G = ReflectionGroup3d(W, (3,2))
+        sage: H = ReflectionGroup3d(W, (1,5))
+        sage: group_data_cache.info()
+        {'hits': 1, 'maxsize': 16, 'misses': 1, 'size': 1}
+        sage: G._coset_table is H._coset_table
+        True
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        """
+        Return the entry stored under ``key``, or ``None`` if there is none.
+        """
+        try:
+            data = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = data
+        self.hits += 1
+        return data
+
+    def put(self, key, data):
+        """
+        Store ``data`` under ``key``, evicting the least recently used entries
+        beyond ``maxsize``.
+        """
+        self._entries.pop(key, None)
+        self._entries[key] = data
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def info(self):
+        """
+        Return a dictionary with the hit and miss counters and the cache size.
+        """
+        return {"hits":self.hits, "misses":self.misses,
+                "size":len(self._entries), "maxsize":self.maxsize}
+
+    def clear(self):
+        """
+        Remove all entries and reset the counters.
+        """
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+group_data_cache = _GroupDataCache()
+
+
+class _ModelStats(object):
+    """
+    Timings and counters of the phases of building and drawing a model.
+
+    For every phase the total time and the number of calls are accumulated;
+    phases may be nested, and then each one includes the time of the phases
+    it calls. Counters record amounts of work, such as the number of cosets
+    enumerated or of polyhedra built.
+
+    If ``hook`` is given, it is called as ``hook("phase", name, seconds)``
+    at the end of every phase and ``hook("count", name, amount)`` at every
+    count, for example to forward them to a tracing system.
+    """
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.times = {}
+        self.calls = {}
+        self.counters = {}
+
+    @contextmanager
+    def phase(self, name):
+        start = time()
+        try:
+            yield
+        finally:
+            elapsed = time() - start
+            self.times[name] = self.times.get(name, 0) + elapsed
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self.hook is not None:
+                self.hook("phase", name, elapsed)
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+        if self.hook is not None:
+            self.hook("count", name, amount)
+
+    def as_dict(self):
+        return {"times":dict(self.times), "calls":dict(self.calls),
+                "counters":dict(self.counters)}
+
+
+def _timed(method):
+    """
+    Decorate a method of :class:`ReflectionGroup3d` so that its calls are
+    recorded as a phase, named after the method, in the model's stats.
+    """
+    @wraps(method)
+    def timed_method(self, *args, **kwds):
+        with self._stats.phase(method.__name__):
+            return method(self, *args, **kwds)
+    return timed_method
+
+
+ProjectionFrame = namedtuple("ProjectionFrame", ["index", "proj_plane", "positions", "mesh"])
+
+CayleyShell = namedtuple("CayleyShell", ["length", "vertex_ids", "perms", "positions",
+                                         "edges", "edge_positions"])
+
+PrintabilityReport = namedtuple("PrintabilityReport", ["vertex_overlaps", "edge_crossings",
+                                                       "polygon_intersections", "thin_features"])
+
+
+class _SharedGroupData(object):
+    """
+    Attribute of :class:`ReflectionGroup3d` that depends only on the group.
+
+    On first access the value is taken from the model's ``group_data_cache``
+    entry, computing it there if no model of the group needed it before,
+    and is then stored on the instance.
+    """
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance._shared_group_data(self.name)
+        instance.__dict__[self.name] = value
+        return value
+
 
 class ReflectionGroup3d(SageObject): # we might want to inherit from an object. Graphics?
     """docstring for """
-    def __init__(self, group, point=(20,10,30), proj_plane=[0,0,0,1]):
+    def __init__(self, group, point=(20,10,30), proj_plane=[0,0,0,1], lazy=False,
+                 projection="orthogonal", tolerance=1e-9, stats_hook=None):
+        self._stats = _ModelStats(stats_hook)
+        with self._stats.phase("__init__"):
+            self._init(group, point, proj_plane, lazy, projection, tolerance)
+
+    def _init(self, group, point, proj_plane, lazy, projection, tolerance):
         self._verify_group(group)
         self.group = group
 
@@ -50,17 +394,29 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
 
         self._verify_proj_plane(proj_plane)
         self.proj_plane = proj_plane
+        self._projection = Projection(proj_plane, projection)
 
-        self.reflections = self.group.reflections()
+        # geometry is computed in float64; points closer than tolerance
+        # (relative to the size of the model) are treated as coincident
+        self.tolerance = tolerance
 
+        key = repr(group)
+        self._group_data = group_data_cache.get(key)
+        if self._group_data is None:
+            self._group_data = {}
+            group_data_cache.put(key, self._group_data)
+        else:
+            self._stats.count("group data cache hits")
+
+        # "radius" is the point3d size of the vertices drawn as Sage points,
+        # "sphere_radius" their radius in model units in triangle meshes
         self.vertex_properties = {"radius":10,
+                                  "sphere_radius":.05,
                                   "shape":"sphere",
                                   "label":None,
                                   "visible":True,
                                   "position":None,
                                   "color":"gray"}
-        self.vertices = {}
-        self._construct_vertices_dict()
 
         self.edge_properties = {"edge_thickness":.01,
                                 "color":"gray",
@@ -73,10 +429,16 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
 
         # if x param exists: set it
         # else: add default
-        self.edges = {}
-        self._construct_edges_dict()
 
-        self.outside_edges = {}
+        # In lazy mode the positions, vertex and edge tables and outside
+        # edges are lazy attributes, computed when first needed.
+        self._lazy = lazy
+        self._partial_reflection_edges = {}
+        # level of detail of the cached graphics, None for Sage primitives
+        self._plot_detail = None
+        if not lazy:
+            self._construct_vertices_dict()
+            self._construct_edges_dict()
 
 
         # get methods, set methods, and how plot3d will take parameters
@@ -84,6 +446,262 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
 
 
 
+    # attributes computed from the group alone, shared through group_data_cache
+    _ELEMENT_DATA = ("reflections", "_elements", "_element_index", "_matrices",
+                     "_element_perms", "_perm_index")
+    _COSET_DATA = ("_reflection_classes", "_reflection_powers", "_coset_table",
+                   "reflection_edges", "_edge_keys", "_edge_offsets", "_edge_index",
+                   "_reflection_class_index", "_edge_vertex_ptr", "_edge_vertices",
+                   "_vertex_edge_ptr", "_vertex_edges", "_orders", "_order_edge_ptr",
+                   "_order_edges")
+
+    reflections = _SharedGroupData("reflections")
+    _elements = _SharedGroupData("_elements")
+    _element_index = _SharedGroupData("_element_index")
+    _matrices = _SharedGroupData("_matrices")
+    _element_perms = _SharedGroupData("_element_perms")
+    _perm_index = _SharedGroupData("_perm_index")
+    _reflection_classes = _SharedGroupData("_reflection_classes")
+    _reflection_powers = _SharedGroupData("_reflection_powers")
+    _coset_table = _SharedGroupData("_coset_table")
+    reflection_edges = _SharedGroupData("reflection_edges")
+    _edge_keys = _SharedGroupData("_edge_keys")
+    _edge_offsets = _SharedGroupData("_edge_offsets")
+    _edge_index = _SharedGroupData("_edge_index")
+    _reflection_class_index = _SharedGroupData("_reflection_class_index")
+    _edge_vertex_ptr = _SharedGroupData("_edge_vertex_ptr")
+    _edge_vertices = _SharedGroupData("_edge_vertices")
+    _vertex_edge_ptr = _SharedGroupData("_vertex_edge_ptr")
+    _vertex_edges = _SharedGroupData("_vertex_edges")
+    _orders = _SharedGroupData("_orders")
+    _order_edge_ptr = _SharedGroupData("_order_edge_ptr")
+    _order_edges = _SharedGroupData("_order_edges")
+
+    def _shared_group_data(self, name):
+        """
+        Return the attribute ``name``, which depends only on the group, from
+        the ``group_data_cache`` entry of the group.
+
+        The attributes are computed in two stages, each at most once per
+        group: first the element enumeration, matrices and root
+        permutations, then the coset table, edge index and adjacency index.
+        Arrays in the cache are made read-only since they are shared
+        between models.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",2])
+            sage: G = ReflectionGroup3d(W, (3,2))
+            sage: G._matrices.flags.writeable
+            False
+
+        Building a model from an empty cache computes the bulk matrices
+        from the root permutations, and they agree with the matrices of
+        the elements::
+
+            sage: group_data_cache.clear()
+            sage: G = ReflectionGroup3d(ReflectionGroup(["A",3]))
+            sage: all(numpy.allclose(G._matrices[i], G._matrix(g))
+            ....:     for i, g in enumerate(G._elements))
+            True
+            sage: G.stats()["counters"]["element matrices"]
+            3
+        """
+        data = self._group_data
+        if name not in data:
+            with self._stats.phase("group data"):
+                if name in self._ELEMENT_DATA:
+                    self.reflections = self.group.reflections()
+
+                    # fixed enumeration of the group; row i of every array-backed
+                    # table below refers to self._elements[i]
+                    self._elements = self.group.list()
+                    self._element_index = {g:i for i, g in enumerate(self._elements)}
+                    # root permutations in one-line notation, one call per element;
+                    # set first, since the matrices are computed from them
+                    self._element_perms = [tuple(x - 1 for x in g.domain())
+                                           for g in self._elements]
+                    self._perm_index = {perm:i for i, perm in enumerate(self._element_perms)}
+                    self._matrices = self._element_matrices()
+                    self._matrices.flags.writeable = False
+                    names = self._ELEMENT_DATA
+                else:
+                    self._build_coset_table()
+                    for table in self._coset_table:
+                        table.flags.writeable = False
+                    self._build_edge_index()
+                    self._build_adjacency()
+                    names = self._COSET_DATA
+                for attr in names:
+                    data[attr] = self.__dict__[attr]
+        return data[name]
+
+    @lazy_attribute
+    def _positions(self):
+        """
+        The float64 array of vertex positions, see :meth:`_batch_positions`.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",2])
+            sage: G = ReflectionGroup3d(W, (3,2), lazy=True)
+            sage: G._positions.shape
+            (6, 3)
+            sage: "vertices" in G.__dict__, "_coset_table" in G.__dict__
+            (False, False)
+        """
+        if self.real_dimension == 4:
+            return self._projection(self._positions4d)
+        return self._batch_positions(self.init_point)
+
+    @lazy_attribute
+    def _positions4d(self):
+        """
+        For complex groups, the float64 array of vertex positions in real
+        4d space, before projection.
+        """
+        return self._realified_positions(self.init_point)
+
+    @lazy_attribute
+    def _vertex_representatives(self):
+        """
+        The array whose entry ``i`` is the smallest vertex id whose position
+        coincides with that of vertex ``i``, up to ``self.tolerance``.
+
+        Vertices coincide when the base point lies on a reflecting
+        hyperplane.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",2])
+            sage: G = ReflectionGroup3d(W, (1,0))
+            sage: len(set(G._vertex_representatives))
+            3
+        """
+        keys = self._snap(self._positions)
+        _, first, inverse = numpy.unique(keys, axis=0, return_index=True,
+                                         return_inverse=True)
+        return first[inverse.reshape(-1)]
+
+    def _snap(self, points):
+        """
+        Return the points of the array ``points`` rounded to a grid of step
+        ``self.tolerance`` times the size of the model, as integer arrays.
+
+        Points that are equal up to the tolerance are (barring the grid
+        boundaries) rounded to the same grid point, which makes positions
+        hashable and comparable.
+        """
+        step = self.tolerance*max(numpy.abs(self._positions).max(), 1)
+        return numpy.round(numpy.asarray(points, dtype=float)/step).astype(numpy.int64)
+
+    def verify_positions(self, sample=10):
+        """
+        Check the float64 vertex positions against positions computed with
+        the exact element matrices, for ``sample`` random elements (all of
+        them if ``sample`` is ``None``).
+
+        Positions are compared before projection, in real space of dimension
+        ``self.real_dimension``, using 100 bits of precision for the exact
+        side.
+
+        OUTPUT:
+
+        The largest difference found. A ``ValueError`` is raised if it is
+        above the tolerance of the model.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["H",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: G.verify_positions() < 1e-9
+            True
+        """
+        n = len(self._elements)
+        if sample is None or sample >= n:
+            ids = range(n)
+        else:
+            ids = numpy.random.choice(n, sample, replace=False)
+        if self.real_dimension == 4:
+            approximate = self._positions4d
+        else:
+            approximate = self._realified_positions(self.init_point)
+        CF = ComplexField(100)
+        error = 0
+        for i in ids:
+            exact = self._elements[i].matrix()*self.init_point
+            if self.group.is_real():
+                coordinates = [CF(x).real_part() for x in exact]
+            else:
+                coordinates = [part for x in exact
+                               for part in (CF(x).real_part(), CF(x).imag_part())]
+            error = max(error, max(abs(float(c) - a)
+                                   for c, a in zip(coordinates, approximate[i])))
+        bound = self.tolerance*max(numpy.abs(self._positions).max(), 1)
+        if error > bound:
+            raise ValueError("Positions are off by %s, more than the tolerance %s" % (error, bound))
+        return error
+
+    @lazy_attribute
+    def vertices(self):
+        """
+        The table of vertex properties, see :meth:`_construct_vertices_dict`.
+        """
+        self._construct_vertices_dict()
+        return self.vertices
+
+    @lazy_attribute
+    def edges(self):
+        """
+        The table of edge properties, see :meth:`_construct_edges_dict`.
+        """
+        self._construct_edges_dict()
+        return self.edges
+
+    @lazy_attribute
+    def outside_edges(self):
+        """
+        The classification of edges computed by :meth:`_outside_edges`.
+        """
+        return self._classify_edges()
+
+    def stats(self):
+        """
+        Return the timings and counters recorded for this model.
+
+        Every phase of construction and drawing (``__init__``, the
+        construction of the vertex and edge tables and of the group data,
+        ``_classify_edges``, ``plot3d``, ``_create_edge``,
+        ``_thicken_polygon``, ``export_mesh``, ...) is timed whenever it
+        runs. A function ``stats_hook`` given to the constructor receives
+        the same information as it is recorded, see :class:`_ModelStats`.
+
+        OUTPUT:
+
+        A dictionary with keys ``"times"`` (total seconds per phase),
+        ``"calls"`` (calls per phase) and ``"counters"``.
+
+        EXAMPLES:
+
+            sage: group_data_cache.clear()
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: stats = G.stats()
+            sage: stats["counters"]["cosets enumerated"]
+            72
+            sage: sorted(stats["times"])
+            ['__init__', '_build_coset_table', '_construct_edges_dict',
+             '_construct_vertices_dict', '_element_matrices', 'group data']
+
+        ::
+
+            sage: events = []
+            sage: G = ReflectionGroup3d(W, stats_hook=lambda *event: events.append(event))
+            sage: events[-1][:2]
+            ('phase', '__init__')
+        """
+        return self._stats.as_dict()
+
     def _verify_group(self, group):
         """
         Perform error checking on group input
@@ -123,7 +741,7 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             TypeError: Group should be defined as a ReflectionGroup
 
         """
-        if group.parent() in [ReflectionGroup((3,1,2)).parent(),ReflectionGroup(["A",2]).parent()]:
+        if isinstance(group, ComplexReflectionGroup):
             if group.rank() < 3:
                 return True
             elif group.rank() == 3:
@@ -240,6 +858,7 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             raise TypeError("plane is determined by a non-zero normal vector in R^4")
 
 
+    @_timed
     def _construct_vertices_dict(self):
         """
         Create a dictionary whose keys are properties, and whose values
@@ -249,6 +868,10 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
         are group elements and whose values are the values of the
         corresponding properties.
 
+        The dictionary is a :class:`_PropertyTable`: each property is stored
+        as one numpy column indexed by the vertex ids of ``self._elements``,
+        and the value-dictionaries are views on those columns.
+
 
         OUTPUT:
 
@@ -264,31 +887,505 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             sage: W = ReflectionGroup(["A",2])
             sage: G = ReflectionGroup3d(W, (3,2))
             sage: G.vertex_properties.keys()
-            ['color', 'label', 'visible', 'shape', 'radius', 'position']
+            ['color', 'label', 'visible', 'shape', 'radius', 'position', 'sphere_radius']
             sage: G.vertices["position"].values()
-            [(-5, 3, 0), (5, -2, 0), (-3, 5, 0), (3, 2, 0), (2, -5, 0), (-2, -3, 0)]
+            [(-5.0, 3.0, 0.0), (5.0, -2.0, 0.0), (-3.0, 5.0, 0.0), (3.0, 2.0, 0.0), (2.0, -5.0, 0.0), (-2.0, -3.0, 0.0)]
 
         """
-        def pad_position(v, point):
-            pos = v.matrix()*point
-            # tup_pos = tuple(v.matrix()*point)
-            if self.real_dimension < 3:
-                return vector(tuple(pos)+((0,)*(3-len(pos))))
-            elif self.real_dimension == 3:
-                return pos
-            else:
-                pos4d = vector((CC(pos[0]).real_part(), CC(pos[0]).imag_part(), CC(pos[1]).real_part(), CC(pos[1]).imag_part()))
-                proj_pos4d = pos4d - vector(self.proj_plane).normalized().dot_product(pos4d)*pos4d.normalized()
-                return proj_pos4d[0:3]
-
+        self.vertices = _PropertyTable(self._elements, self._element_index)
+        self._vertex_graphics = {}
         for key, value in self.vertex_properties.items():
             if key=="position":
-                self.vertices[key] = \
-                {v:pad_position(v, self.init_point) for v in self.group.list()}
-                # style?
+                self.vertices.add_column(key, column=self._positions)
             else:
-                self.vertices[key] = {v:value for v in self.group.list()}
+                self.vertices.add_column(key, value)
+
+    @_timed
+    def _element_matrices(self):
+        """
+        Return the matrices of all group elements stacked into one array.
+
+        Row ``i`` of the result is the matrix of ``self._elements[i]``.
+        Real groups give a float64 array, complex groups a complex128 array.
+
+        OUTPUT:
+
+        A numpy array of shape ``(N, d, d)`` where ``N`` is the order of
+        the group and ``d`` its rank.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",2])
+            sage: G = ReflectionGroup3d(W, (3,2))
+            sage: G._matrices.shape
+            (6, 2, 2)
+            sage: G._matrices.dtype
+            dtype('float64')
+        """
+        mats = self._bulk_matrices()
+        if mats is None:
+            self._stats.count("element matrices", len(self._elements))
+            mats = numpy.array([self._matrix(g) for g in self._elements])
+        if self.group.is_real():
+            return numpy.ascontiguousarray(mats.real)
+        return mats
+
+    def _matrix(self, g):
+        """
+        Return the matrix of the group element ``g`` as a complex numpy array.
+        """
+        return numpy.array([[complex(CC(x)) for x in row] for row in g.matrix().rows()])
+
+    def _bulk_matrices(self):
+        """
+        Return the matrices of all group elements, computed in one batch
+        from the root permutations ``self._element_perms``, or ``None`` if
+        the roots do not determine them.
+
+        See :meth:`_matrices_from_perms`.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup((3,1,2))
+            sage: G = ReflectionGroup3d(W, (1,2), lazy=True)
+            sage: mats = G._bulk_matrices()
+            sage: all(numpy.allclose(mats[i], G._matrix(g)) for i, g in enumerate(G._elements))
+            True
+        """
+        if self._root_solver is None:
+            return None
+        return self._matrices_from_perms(numpy.array(self._element_perms))
+
+    @lazy_attribute
+    def _root_solver(self):
+        """
+        The triple ``(basis roots, basis indices, transposed)`` used by
+        :meth:`_matrices_from_perms`, or ``None`` if the roots of the group
+        do not determine the element matrices.
+
+        The roots of the group are converted to numpy once. Whether the
+        matrices act on columns or on rows is decided by comparing with the
+        matrices of the generators, so no other element is converted on
+        its own.
+        """
+        rank = self.group.rank()
+        gens = self.group.gens()
+        perms = numpy.array([[x - 1 for x in s.domain()] for s in gens])
+        roots = numpy.array([[complex(CC(x)) for x in root] for root in self.group.roots()])
+        if roots.shape != (perms.shape[1], rank):
+            return None
+        basis = []
+        for i in range(len(roots)):
+            if numpy.linalg.matrix_rank(roots[basis + [i]]) > len(basis):
+                basis.append(i)
+            if len(basis) == rank:
+                break
+        solved = numpy.linalg.solve(roots[basis][None], roots[perms[:, basis]])
+        self._stats.count("element matrices", len(gens))
+        for transposed, mats in ((True, solved.transpose(0, 2, 1)), (False, solved)):
+            if all(numpy.allclose(mats[i], self._matrix(s), atol=self.tolerance)
+                   for i, s in enumerate(gens)):
+                return roots, basis, transposed
+        return None
+
+    def _matrices_from_perms(self, perms):
+        """
+        Return the complex matrices of the group elements whose root
+        permutations are the rows of the integer array ``perms``.
+
+        Every element maps a basis of roots to the roots given by its
+        permutation, so its matrix is the solution of one linear system,
+        and all systems are solved at once.
+        """
+        roots, basis, transposed = self._root_solver
+        # row i of the right hand side of g is the image under g of basis root i
+        solved = numpy.linalg.solve(roots[basis][None], roots[perms[:, basis]])
+        return solved.transpose(0, 2, 1) if transposed else solved
+
+    def _realified_positions(self, point, mats=None):
+        """
+        Return the positions of all vertices for the base point ``point`` in
+        real space of dimension ``self.real_dimension``.
+
+        All positions come from a single contraction of the stacked element
+        matrices with ``point``. For complex groups each complex coordinate
+        is split into its real and imaginary parts.
+
+        INPUT:
+
+        - ``point`` -- a vector of length equal to the rank of the group
+
+        - ``mats`` -- (default: ``self._matrices``) a stack of element
+          matrices, for the positions of only these elements
+
+        OUTPUT:
+
+        A float64 numpy array of shape ``(N, self.real_dimension)``, whose
+        row ``i`` is the position of ``self._elements[i]``.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup((3,1,2))
+            sage: G = ReflectionGroup3d(W, (1,2))
+            sage: G._realified_positions(vector((1,2)))[0]
+            array([ 1.,  0.,  2.,  0.])
+        """
+        p = numpy.array([complex(CC(x)) for x in point])
+        if mats is None:
+            mats = self._matrices
+        if self.group.is_real():
+            return numpy.einsum("nij,j->ni", mats.real, p.real)
+        pos = numpy.einsum("nij,j->ni", mats, p)
+        realified = numpy.empty((len(pos), 2*pos.shape[1]))
+        realified[:, 0::2] = pos.real
+        realified[:, 1::2] = pos.imag
+        return realified
+
+    def _batch_positions(self, point, mats=None, radius=None):
+        r"""
+        Return the 3d positions of all vertices for the base point ``point``.
+
+        Rank 2 real groups are padded with zeros, and complex groups of rank
+        2 are realified into $\mathbb{R}^4$ and projected by the model's
+        :class:`~cayley_projection.Projection` (along ``self.proj_plane``).
+
+        INPUT:
+
+        - ``point`` -- a vector of length equal to the rank of the group
+
+        - ``mats`` -- (default: ``self._matrices``) a stack of element
+          matrices, for the positions of only these elements
+
+        - ``radius`` -- (optional) the scale of Schlegel and stereographic
+          projections, see :class:`~cayley_projection.Projection`
+
+        OUTPUT:
+
+        A float64 numpy array of shape ``(N, 3)``, whose row ``i`` is the
+        position of ``self._elements[i]``.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",2])
+            sage: G = ReflectionGroup3d(W, (3,2))
+            sage: G._batch_positions(vector((3,2)))
+            array([[ 3.,  2.,  0.],
+                   ...
+        """
+        pos = self._realified_positions(point, mats)
+        if self.real_dimension < 3:
+            padded = numpy.zeros((len(pos), 3))
+            padded[:, :pos.shape[1]] = pos
+            return padded
+        elif self.real_dimension == 3:
+            return numpy.ascontiguousarray(pos)
+        else:
+            return self._projection(pos, radius)
+
+    def set_projection(self, mode=None, proj_plane=None, distance=None):
+        r"""
+        Change how a complex group's model is projected from 4d to 3d.
+
+        The 4d positions are kept, so this only recomputes the projection,
+        in place, and marks all vertices and edges as changed. Arguments
+        that are not given keep their current value.
+
+        INPUT:
+
+        - ``mode`` -- one of ``"orthogonal"``, ``"schlegel"`` or
+          ``"stereographic"``
+
+        - ``proj_plane`` -- a nonzero normal vector in $\mathbb{R}^4$
+
+        - ``distance`` -- for Schlegel projections, the distance of the
+          center of projection, as a multiple of the radius of the model
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup((3,1,2))
+            sage: G = ReflectionGroup3d(W, (1,2))
+            sage: G.set_projection("stereographic", proj_plane=[0,1,0,1])
+            sage: G._projection
+            Stereographic projection along (0, 1, 0, 1)
+        """
+        if proj_plane is not None:
+            self._verify_proj_plane(proj_plane)
+            self.proj_plane = proj_plane
+        self._projection = Projection(self.proj_plane,
+                                      mode or self._projection.mode,
+                                      distance or self._projection.distance)
+        if self.real_dimension == 4:
+            self._positions[:] = self._projection(self._positions4d)
+            for table in ("vertices", "edges"):
+                if table in self.__dict__:
+                    self.__dict__[table].dirty[:] = True
+            self.__dict__.pop("outside_edges", None)
+            self.__dict__.pop("_outside_edge_labels", None)
+            self.__dict__.pop("_vertex_representatives", None)
+
+    def projection_frames(self, planes=None, rotation=None, steps=None,
+                          mode=None, mesh=False):
+        r"""
+        Iterate over the frames of an animation sweeping the projection
+        plane of a complex group's model.
+
+        The sweep either follows the given normal vectors ``planes``, or
+        starts at ``self.proj_plane`` and applies the rotation ``rotation``
+        of $\mathbb{R}^4$ ``steps`` times. Frames are computed one at a time
+        from the 4d positions; the model itself, its group data and its
+        edge tables are not changed, so memory does not grow with the
+        number of frames.
+
+        INPUT:
+
+        - ``planes`` -- an iterable of nonzero vectors in $\mathbb{R}^4$
+
+        - ``rotation`` -- a ``4 x 4`` orthogonal matrix, see
+          :func:`~cayley_projection.rotation_matrix`
+
+        - ``steps`` -- the number of frames of a rotation sweep
+
+        - ``mode`` -- the projection mode (by default the model's)
+
+        - ``mesh`` -- whether frames carry the triangle mesh of the model,
+          see :meth:`export_mesh`
+
+        OUTPUT:
+
+        An iterator of ``ProjectionFrame`` named tuples ``(index, proj_plane,
+        positions, mesh)``, where ``positions`` is the ``(N, 3)`` array of
+        vertex positions and ``mesh`` is ``None`` or a pair ``(points,
+        triangles)``. The triangles depend only on the topology of the model,
+        so all frames share the same triangle array.
+
+        EXAMPLES:
+
+            sage: from cayley_projection import rotation_matrix
+            sage: W = ReflectionGroup((3,1,2))
+            sage: G = ReflectionGroup3d(W, (1,2))
+            sage: frames = G.projection_frames(rotation=rotation_matrix(1, 3, float(pi/50)), steps=100)
+            sage: frame = next(frames)
+            sage: frame.index, frame.proj_plane, frame.positions.shape
+            (0, (0.0, 0.0, 0.0, 1.0), (18, 3))
+        """
+        if self.real_dimension != 4:
+            raise TypeError("Projection sweeps only apply to complex groups of rank 2")
+        if planes is None:
+            if rotation is None or steps is None:
+                raise ValueError("Give either the projection planes or a rotation and a number of steps")
+            planes = rotated_planes(self.proj_plane, rotation, steps)
+
+        triangles = None
+        for index, plane in enumerate(planes):
+            projection = Projection(plane, mode or self._projection.mode,
+                                    self._projection.distance)
+            positions = projection(self._positions4d)
+            frame_mesh = None
+            if mesh:
+                points, frame_triangles = merge_meshes(self._mesh_chunks(positions=positions))
+                if triangles is None:
+                    triangles = frame_triangles
+                frame_mesh = (points, triangles)
+            yield ProjectionFrame(index, tuple(float(x) for x in plane), positions, frame_mesh)
+
+    @lazy_attribute
+    def _reflection_subgroups(self):
+        """
+        The list of the cyclic subgroups generated by reflections, in the
+        order of ``self._reflection_classes``, each as the integer array
+        whose row ``k`` is the root permutation of ``r^k``.
+
+        Only the reflections are listed, not the group.
+        """
+        seen = set()
+        subgroups = []
+        for refl in self.group.reflections():
+            perm = numpy.array([x - 1 for x in refl.domain()], dtype=numpy.intp)
+            if perm.tobytes() in seen:
+                continue
+            powers = [numpy.arange(len(perm))]
+            power = perm
+            while not (power == powers[0]).all():
+                powers.append(power)
+                power = power[perm]
+            seen.update(power.tobytes() for power in powers[1:])
+            subgroups.append(numpy.array(powers))
+        return subgroups
+
+    def shells(self, max_length=None, max_size=None):
+        r"""
+        Iterate over the vertices and edges of the model one shell of the
+        Cayley graph at a time, without listing the group.
+
+        The group elements are enumerated breadth first from the identity
+        by multiplying with the generators of the group, as root
+        permutations. Shell ``k`` holds the elements of word length ``k`` in
+        the generators, and the edges they complete: the cosets of the
+        reflection subgroups all of whose elements have been reached. Each
+        shell is positioned and yielded on its own, so partial models of
+        groups too large to list can be built and exported ball by ball
+        (see :meth:`export_ball`).
+
+        Memory grows with the ball, not with the shell: the ids and
+        positions of all the elements reached so far are kept, since the
+        elements of an edge may lie many shells apart, but no vertex or
+        edge tables, graphics or meshes of earlier shells are.
+
+        Schlegel and stereographic projections are scaled to the norm of
+        the base point, which all vertices share when the group acts by
+        unitary matrices.
+
+        INPUT:
+
+        - ``max_length`` -- (optional) the largest word length enumerated
+
+        - ``max_size`` -- (optional) the largest number of vertices
+          enumerated; the last shell is cut short to stay within it
+
+        OUTPUT:
+
+        An iterator of ``CayleyShell`` named tuples ``(length, vertex_ids,
+        perms, positions, edges, edge_positions)``: the word length, the
+        ids given to the new vertices, their root permutations (as the rows
+        of an integer array, counting roots from 0) and 3d positions, and
+        for every reflection subgroup (see ``self._reflection_subgroups``),
+        the integer array of the vertex ids of the new edges, one edge
+        ``g, rg, r^2g, ...`` per row, and the array of their positions.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W, lazy=True)
+            sage: [len(shell.vertex_ids) for shell in G.shells()]
+            [1, 3, 5, 6, 5, 3, 1]
+            sage: sum(len(edges) for shell in G.shells() for edges in shell.edges)
+            72
+            sage: [len(shell.vertex_ids) for shell in G.shells(max_length=2)]
+            [1, 3, 5]
+            sage: [len(shell.vertex_ids) for shell in G.shells(max_size=6)]
+            [1, 3, 2]
+        """
+        if self._root_solver is None:
+            raise NotImplementedError("the roots of the group do not determine its matrices")
+        gens = numpy.array([[x - 1 for x in s.domain()] for s in self.group.gens()],
+                           dtype=numpy.intp)
+        subgroups = self._reflection_subgroups
+        radius = numpy.linalg.norm([complex(CC(x)) for x in self.init_point])
+        ids = {}
+        positions = numpy.empty((64, 3))
+        layer = numpy.arange(gens.shape[1])[None]
+        length = 0
+        while len(layer):
+            last = max_length is not None and length >= max_length
+            if max_size is not None and len(ids) + len(layer) >= max_size:
+                layer = layer[:max_size - len(ids)]
+                last = True
+            start = len(ids)
+            for row in layer:
+                ids[row.tobytes()] = len(ids)
+            vertex_ids = numpy.arange(start, len(ids))
+            mats = self._matrices_from_perms(layer)
+            self._stats.count("vertices enumerated", len(layer))
+            while len(positions) < len(ids):
+                positions = numpy.concatenate((positions, numpy.empty_like(positions)))
+            positions[start:len(ids)] = self._batch_positions(self.init_point, mats, radius)
+
+            # an edge is complete once all its elements are reached, and is
+            # emitted with the last of them
+            edges, edge_positions = [], []
+            for powers in subgroups:
+                rows = numpy.array([[ids.get(member.tobytes(), -1) for member in layer[:, power]]
+                                    for power in powers]).T.reshape(len(layer), len(powers))
+                rows = rows[(rows >= 0).all(axis=1) & (rows.max(axis=1) == vertex_ids)]
+                edges.append(rows)
+                edge_positions.append(positions[rows])
+            yield CayleyShell(length, vertex_ids, layer, positions[start:len(ids)].copy(),
+                              edges, edge_positions)
+
+            if last:
+                return
+            length += 1
+            new = {}
+            for s in gens:
+                for row in layer[:, s]:
+                    key = row.tobytes()
+                    if key not in ids and key not in new:
+                        new[key] = row
+            layer = numpy.array(list(new.values()), dtype=numpy.intp).reshape(-1, gens.shape[1])
+
+    @_timed
+    def export_ball(self, output, fmt=None, max_length=None, max_size=None,
+                    quality="print"):
+        r"""
+        Write the part of the model within a ball of the Cayley graph as a
+        triangle mesh, one shell at a time, without listing the group.
+
+        The vertices and edges are enumerated by :meth:`shells`, and meshed
+        as by :meth:`export_mesh` with the model's default properties
+        ``self.vertex_properties`` and ``self.edge_properties``.
+
+        INPUT:
+
+        - ``output`` -- a filename or a writable binary file object
+
+        - ``fmt`` -- one of ``"stl"``, ``"obj"`` or ``"3mf"``; by default
+          it is taken from the extension of ``output``
+
+        - ``max_length``, ``max_size`` -- the bounds of the ball, see
+          :meth:`shells`
+
+        - ``quality`` -- the quality tier of the spheres and tubes, see
+          :meth:`level_of_detail`; as the ball is not known in advance, no
+          budget can be given
+
+        OUTPUT:
+
+        The number of triangles written.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W, lazy=True)
+            sage: import io
+            sage: G.export_ball(io.BytesIO(), "stl")
+            4224
+            sage: G.export_ball(io.BytesIO(), "stl", max_length=1)
+            416
+        """
+        if fmt is None:
+            fmt = format_from_filename(output)
+        return write_mesh(output, self._ball_meshes(max_length, max_size,
+                                                    level_of_detail(quality)), fmt)
 
+    def _ball_meshes(self, max_length=None, max_size=None, detail=None):
+        """
+        Iterate over the meshes of the shells of :meth:`export_ball`.
+        """
+        if detail is None:
+            detail = QUALITY_TIERS["print"]
+        vertex, edge = self.vertex_properties, self.edge_properties
+        for shell in self.shells(max_length, max_size):
+            if vertex["visible"]:
+                yield sphere_mesh(shell.positions, numpy.full(len(shell.positions), vertex["sphere_radius"]),
+                                  detail.sphere_segments, detail.sphere_rings)
+            if not edge["visible"]:
+                continue
+            for corners in shell.edge_positions:
+                if len(corners) == 0:
+                    continue
+                tubes = numpy.full(corners.size//3, edge["edge_thickness"])
+                if corners.shape[1] == 2:
+                    yield tube_mesh(corners[:, 0], corners[:, 1], tubes[:len(corners)],
+                                    detail.tube_segments)
+                    continue
+                if edge["fill"]:
+                    yield extrude_polygons(corners, edge["boundary_thickness"])
+                if edge["boundaries"]:
+                    yield tube_mesh(corners.reshape(-1, 3),
+                                    numpy.roll(corners, -1, axis=1).reshape(-1, 3), tubes,
+                                    detail.boundary_segments)
+
+    @_timed
     def _construct_edges_dict(self):
         """
         Constructs the dictionary of edge properties.
@@ -320,74 +1417,392 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             - The properties for the edges should be able to be changed by user
               inputs in constructing the models, as well.
         """
-        cosets = []
-
-        reflections = self.group.reflections().list()
-        subgroups = []
-        self.reflection_edges = {}
-        while reflections: # is nonempty
-            refl = reflections[0]
-            subgroup = self.group.subgroup([refl])
-            subgroups.append(subgroup)
-            coset = self.group.cosets(subgroup)
-            self.reflection_edges[refl] = [tuple(e) for e in coset]
-
-            cosets += coset
-            i=1
-            while i<refl.order():
-                reflections.remove(refl**i)
-                i+=1
-
+        self.edges = _PropertyTable(self._edge_keys, self._edge_index)
+        self._edge_graphics = {}
         for key, value in self.edge_properties.items():
+            self.edges.add_column(key, value)
             if key=="color":
-                self.edges[key] = {}
-                acc = 0
                 seed(time())
-                for subgp in subgroups:
-                    acc += 1
-                    color = (randint(0,255), randint(0,255), randint(0,255))
-                    for e in self.group.cosets(subgp):
-                        self.edges[key][tuple(e)] = color
-            else:
-                # defaults
-                self.edges[key] = {tuple(e):value for e in cosets}
+                for c in range(len(self._reflection_classes)):
+                    color = (random(), random(), random())
+                    self.edges.fill(key, color,
+                                    slice(self._edge_offsets[c], self._edge_offsets[c+1]))
+
+    @_timed
+    def _build_coset_table(self):
+        """
+        Enumerate the cosets of every reflection subgroup in one pass.
+
+        Group elements are handled as tuples of root images and integer
+        ids (their index in ``self._elements``), so no subgroup or coset
+        is ever constructed through the group interface. Reflections that
+        generate the same cyclic subgroup are grouped together and only
+        the first one met is kept as representative.
+
+        This sets:
+
+        - ``self._reflection_classes`` -- a list of representative reflections,
+          one per reflection subgroup
+
+        - ``self._reflection_powers`` -- a dictionary mapping each representative
+          to the list of its nontrivial powers (all reflections)
+
+        - ``self._coset_table`` -- a list, parallel to ``self._reflection_classes``,
+          of integer numpy arrays of shape ``(number of cosets, order)``. Each row
+          lists the element ids ``g, rg, r^2g, ...`` of one right coset of the
+          subgroup generated by ``r``, starting from its smallest id.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",2])
+            sage: G = ReflectionGroup3d(W, (3,2))
+            sage: len(G._reflection_classes)
+            3
+            sage: [table.shape for table in G._coset_table]
+            [(3, 2), (3, 2), (3, 2)]
+
+        ::
+
+            sage: W = ReflectionGroup((3,1,1))
+            sage: G = ReflectionGroup3d(W, (2,))
+            sage: G._coset_table
+            [array([[0, 1, 2]])]
+        """
+        self._reflection_classes = []
+        self._reflection_powers = {}
+        self._coset_table = []
+        seen = set()
+        for refl in self.reflections:
+            if self._element_perms[self._element_index[refl]] in seen:
+                continue
+            powers, table = self._reflection_cosets(refl)
+            seen.update(self._element_perms[self._element_index[power]]
+                        for power in powers)
+            self._reflection_classes.append(refl)
+            self._reflection_powers[refl] = powers
+            self._coset_table.append(table)
+
+    def _reflection_cosets(self, refl):
+        """
+        Return the nontrivial powers of the reflection ``refl`` and the table
+        of the right cosets of the subgroup it generates.
+
+        See :meth:`_build_coset_table` for the layout of the table.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup((3,1,1))
+            sage: G = ReflectionGroup3d(W, (2,), lazy=True)
+            sage: powers, table = G._reflection_cosets(W.reflections()[1])
+            sage: len(powers), table
+            (2, array([[0, 1, 2]]))
+        """
+        perms = self._element_perms
+        perm_index = self._perm_index
+        refl_perm = perms[self._element_index[refl]]
+        identity = tuple(range(len(refl_perm)))
+        n = len(perms)
+
+        # r^k g in the convention of Sage's (left to right) product r*g
+        powers = []
+        power = refl_perm
+        while power != identity:
+            powers.append(self._elements[perm_index[power]])
+            power = tuple(power[j] for j in refl_perm)
+        order = len(powers) + 1
+        # left multiplication by r as a permutation of the element ids
+        left_mult = [perm_index[tuple(perm[j] for j in refl_perm)]
+                     for perm in perms]
+
+        table = numpy.empty((n // order, order), dtype=numpy.intp)
+        self._stats.count("cosets enumerated", len(table))
+        visited = numpy.zeros(n, dtype=bool)
+        row = 0
+        for start in range(n):
+            if visited[start]:
+                continue
+            i = start
+            for k in range(order):
+                visited[i] = True
+                table[row, k] = i
+                i = left_mult[i]
+            row += 1
+        return powers, table
+
+    def _reflection_representative(self, refl):
+        """
+        Return the representative of the class of the reflection ``refl``
+        in :meth:`_build_coset_table`: the first reflection of the group
+        that ``refl`` is a power of.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup((3,1,1))
+            sage: G = ReflectionGroup3d(W, (2,), lazy=True)
+            sage: r, s = W.reflections()
+            sage: G._reflection_representative(s) == r
+            True
+        """
+        perms = self._element_perms
+        target = perms[self._element_index[refl]]
+        identity = tuple(range(len(target)))
+        for candidate in self.reflections:
+            refl_perm = perms[self._element_index[candidate]]
+            power = refl_perm
+            while power != identity:
+                if power == target:
+                    return candidate
+                power = tuple(power[j] for j in refl_perm)
+        raise KeyError(refl)
+
+    def _build_edge_index(self):
+        """
+        Name the edges given by the rows of the coset table.
+
+        This sets ``self.reflection_edges``, mapping every reflection to
+        the list of its edges (tuples of group elements), and the edge
+        enumeration ``self._edge_keys`` with its inverse ``self._edge_index``.
+        The edges of the ``c``-th reflection class have the ids in
+        ``range(self._edge_offsets[c], self._edge_offsets[c+1])``.
+        """
+        self.reflection_edges = {}
+        self._edge_keys = []
+        self._edge_offsets = [0]
+        for refl, table in zip(self._reflection_classes, self._coset_table):
+            edges = [tuple(self._elements[i] for i in row) for row in table]
+            for power in self._reflection_powers[refl]:
+                self.reflection_edges[power] = edges
+            self._edge_keys.extend(edges)
+            self._edge_offsets.append(len(self._edge_keys))
+        self._edge_index = {e:i for i, e in enumerate(self._edge_keys)}
+
+    def _build_adjacency(self):
+        """
+        Build the adjacency index of the Cayley graph as compressed sparse
+        row (CSR) arrays: for each CSR pair ``(ptr, ids)``, the ids related
+        to item ``i`` are ``ids[ptr[i]:ptr[i+1]]``.
+
+        This sets
+
+        - ``self._edge_vertex_ptr``, ``self._edge_vertices`` -- the vertex
+          ids of each edge, in the order of its coset table row
+
+        - ``self._vertex_edge_ptr``, ``self._vertex_edges`` -- the ids of
+          the edges at each vertex, one per reflection class
+
+        - ``self._orders``, ``self._order_edge_ptr``, ``self._order_edges``
+          -- the sorted edge orders, and the ids of the edges of each order
+
+        - ``self._reflection_class_index`` -- the dictionary mapping every
+          reflection to the index ``c`` of its class, whose edges have the
+          ids ``range(self._edge_offsets[c], self._edge_offsets[c+1])``
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: G._vertex_edge_ptr[:4]
+            array([ 0,  6, 12, 18])
+            sage: G._orders, G._order_edge_ptr
+            (array([2]), array([ 0, 72]))
+        """
+        sizes = numpy.repeat([table.shape[1] for table in self._coset_table],
+                             [len(table) for table in self._coset_table])
+        self._edge_vertex_ptr = numpy.concatenate(([0], numpy.cumsum(sizes)))
+        self._edge_vertices = numpy.concatenate([table.ravel() for table in self._coset_table])
+
+        # every vertex lies on exactly one edge of each reflection class
+        owners = numpy.repeat(numpy.arange(len(sizes)), sizes)
+        self._vertex_edges = owners[numpy.argsort(self._edge_vertices, kind="stable")]
+        counts = numpy.bincount(self._edge_vertices, minlength=len(self._elements))
+        self._vertex_edge_ptr = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+        self._orders, counts = numpy.unique(sizes, return_counts=True)
+        self._order_edges = numpy.argsort(sizes, kind="stable")
+        self._order_edge_ptr = numpy.concatenate(([0], numpy.cumsum(counts)))
+
+        self._reflection_class_index = {}
+        for c, refl in enumerate(self._reflection_classes):
+            for power in self._reflection_powers[refl]:
+                self._reflection_class_index[power] = c
+
+        for name in ("_edge_vertex_ptr", "_edge_vertices", "_vertex_edge_ptr",
+                     "_vertex_edges", "_orders", "_order_edge_ptr", "_order_edges"):
+            self.__dict__[name].flags.writeable = False
+
+    def _vertex_edge_ids(self, g):
+        """
+        Return the array of the ids of the edges at the vertex of ``g``.
+        """
+        i = self._element_index[g]
+        return self._vertex_edges[self._vertex_edge_ptr[i]:self._vertex_edge_ptr[i+1]]
+
+    def _order_edge_ids(self, order):
+        """
+        Return the array of the ids of the edges of order ``order``.
+        """
+        k = numpy.searchsorted(self._orders, order)
+        if k == len(self._orders) or self._orders[k] != order:
+            return self._order_edges[:0]
+        return self._order_edges[self._order_edge_ptr[k]:self._order_edge_ptr[k+1]]
+
+    def _reflection_edge_ids(self, r):
+        """
+        Return the range of the ids of the edges of the reflection ``r``.
+        """
+        try:
+            c = self._reflection_class_index[r]
+        except KeyError:
+            raise KeyError("%s is not a reflection of this group."%str(r))
+        return numpy.arange(self._edge_offsets[c], self._edge_offsets[c+1])
+
+    def vertex_edges(self, g):
+        """
+        Return the edges at the vertex of the group element ``g``, one for
+        each class of reflections, in time proportional to their number.
 
+        This is the star of ``g`` used to highlight it.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: g = W.an_element()
+            sage: edges = G.vertex_edges(g)
+            sage: len(edges), all(g in e for e in edges)
+            (6, True)
+        """
+        return [self._edge_keys[e] for e in self._vertex_edge_ids(g)]
+
+    def vertex_neighbors(self, g):
+        """
+        Return the group elements sharing an edge with ``g``, in time
+        proportional to the number of edges at ``g`` and their orders.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: g = W.an_element()
+            sage: sorted(G.vertex_neighbors(g)) == sorted(r*g for r in W.reflections())
+            True
+        """
+        i = self._element_index[g]
+        ptr = self._edge_vertex_ptr
+        neighbors = set()
+        for e in self._vertex_edge_ids(g):
+            neighbors.update(self._edge_vertices[ptr[e]:ptr[e+1]].tolist())
+        neighbors.discard(i)
+        return [self._elements[j] for j in sorted(neighbors)]
+
+    def edges_of_order(self, order):
+        """
+        Return the edges of the given order, that is, with ``order``
+        vertices.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup((3,1,2))
+            sage: G = ReflectionGroup3d(W, (1,2))
+            sage: sorted(set(len(e) for e in G.edges_of_order(3)))
+            [3]
+            sage: G.edges_of_order(5)
+            []
+        """
+        return [self._edge_keys[e] for e in self._order_edge_ids(order)]
 
     def _outside_edges(self): #if private, "create" method
                                 # if public, return if known, create if uninitialized?
         """
+        Return the classification of edges as 1-faces of the convex hull
+        of the model, contained in its 2-faces, or internal.
+
+        This is the lazy attribute ``self.outside_edges``, computed by
+        :meth:`_classify_edges` on first use.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: sorted(set(G._outside_edges().values()))
+            ['1-face', 'external edge', 'internal edge']
+            sage: G._outside_edges() is G.outside_edges
+            True
+        """
+        return self.outside_edges
+
+    @_timed
+    def _classify_edges(self):
+        """
         Creates a dictionary which categorizes edges as begin 1-faces of the polytope,
         contained in 2-faces of the polytope, or internal to the structure.
+
+        The convex hull of the vertex positions is computed once, in float64,
+        from the positions that are distinct up to ``self.tolerance``, and
+        its vertices are matched to the nearest of them in the neighbouring
+        cells of the tolerance grid. Its faces are indexed by the sets of vertex ids they
+        contain, so every coset of the coset table is classified with a
+        hash lookup and a check against the few 2-faces through one of its
+        vertices.
+
+        OUTPUT:
+
+        A dictionary mapping each edge (a tuple of group elements) to one of
+        ``"1-face"``, ``"external edge"`` or ``"internal edge"``.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: outside = G._classify_edges()
+            sage: len(outside) == len(G._edge_keys)
+            True
         """
-        convex_bounding_polyhedron = Polyhedron(vertices = self.vertices["position"].values())
         outside_edge_dictionary = {}
-        faces1_by_vertices = []
-        faces2_by_vertices = []
-        for face in (convex_bounding_polyhedron.faces(1)):
-            face_vertices = []
-            for i in range(len(face.vertices())):
-                face_vertices.append(tuple(face.vertices()[i]))
-            faces1_by_vertices.append(set(face_vertices))
-        for face in (convex_bounding_polyhedron.faces(2)):
-            face_vertices = []
-            for i in range(len(face.vertices())):
-                face_vertices.append(tuple(face.vertices()[i]))
-            faces2_by_vertices.append(set(face_vertices))
-        for k in self.W.reflections():
-            S = self.W.subgroup([k])
-            for j in range(len(self.W.cosets(S))):
-                vertex_set = []
-                for grp_elm in self.W.cosets(S)[j]:
-                    coordinates = tuple(self.vertices["position"][grp_elm])
-                    vertex_set.append(coordinates)
-                if set(vertex_set) in faces1_by_vertices:
-                    outside_edge_dictionary[tuple(self.W.cosets(S)[j])] = "1-face"
-                elif set(vertex_set) not in faces1_by_vertices:
-                    for two_face in faces2_by_vertices:
-                        if set(vertex_set).issubset(two_face):
-                            outside_edge_dictionary[tuple(self.W.cosets(S)[j])] = "external edge"
-                        else:
-                            outside_edge_dictionary[tuple(self.W.cosets(S)[j])] = "internal edge"
+
+        # coincident vertices only enter the hull once
+        distinct = numpy.unique(self._vertex_representatives)
+        convex_bounding_polyhedron = Polyhedron(vertices=self._positions[distinct].tolist(),
+                                                base_ring=RDF)
+        self._stats.count("polyhedra built")
+
+        # match every hull vertex to the nearest distinct position in its
+        # grid cell or the neighbouring ones, as its coordinates may have
+        # been rounded across a cell boundary, and that position to the ids
+        # of all the vertices there
+        members = {}
+        for i, representative in enumerate(self._vertex_representatives):
+            members.setdefault(representative, set()).add(i)
+        distinct_at = {tuple(key):d for key, d in zip(self._snap(self._positions[distinct]).tolist(),
+                                                     distinct)}
+        hull_points = numpy.array(convex_bounding_polyhedron.vertices_list())
+        hull_ids = []
+        for point, key in zip(hull_points, self._snap(hull_points).tolist()):
+            near = [distinct_at[cell] for cell in itertools.product(*[(x - 1, x, x + 1) for x in key])
+                    if cell in distinct_at]
+            if not near:
+                raise ValueError("the convex hull has a vertex away from the model's vertices")
+            nearest = min(near, key=lambda d: numpy.linalg.norm(self._positions[d] - point))
+            hull_ids.append(members[nearest])
+
+        def face_ids(face):
+            return frozenset().union(*(hull_ids[v.index()] for v in face.vertices()))
+        faces1 = set(face_ids(face) for face in convex_bounding_polyhedron.faces(1))
+        faces2_at = {}
+        for face in convex_bounding_polyhedron.faces(2):
+            ids = face_ids(face)
+            for i in ids:
+                faces2_at.setdefault(i, []).append(ids)
+
+        for refl, table in zip(self._reflection_classes, self._coset_table):
+            for row, edge in zip(table, self.reflection_edges[refl]):
+                ids = frozenset(row.tolist())
+                if ids in faces1:
+                    outside_edge_dictionary[edge] = "1-face"
+                elif any(ids <= face for face in faces2_at.get(int(row[0]), ())):
+                    outside_edge_dictionary[edge] = "external edge"
+                else:
+                    outside_edge_dictionary[edge] = "internal edge"
 
         return outside_edge_dictionary
 
@@ -399,12 +1814,162 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             return self.edges["visible"].keys()
         # if r is in self.group.reflections():
         try:
+            if self._lazy and "reflection_edges" not in self._group_data:
+                # only enumerate the cosets of this reflection
+                if r not in self._partial_reflection_edges:
+                    if r not in self.reflections.list():
+                        raise KeyError(r)
+                    # enumerate the cosets of the class representative, so
+                    # the rows are those of the full coset table
+                    refl = self._reflection_representative(r)
+                    powers, table = self._reflection_cosets(refl)
+                    edges = [tuple(self._elements[i] for i in row) for row in table]
+                    for power in powers:
+                        self._partial_reflection_edges[power] = edges
+                return self._partial_reflection_edges[r]
             return self.reflection_edges[r]
         except KeyError:
             raise KeyError("%s is not a reflection of this group."%str(r))
 
 
-    def edge_thickness(self, edge_thickness=None):
+    def _select(self, table, mask=None, ids=None, keys=None, reflections=None,
+                order=None, outside=None):
+        """
+        Return the sorted array of the ids of the rows of ``table`` (the
+        vertex or edge table) selected by all the given selectors, or the
+        slice of all rows if there are none.
+
+        See :meth:`set_edge_property` for the selectors.
+        """
+        selected = None
+        def meet(new):
+            if selected is None:
+                return numpy.unique(new)
+            return numpy.intersect1d(selected, new)
+        if mask is not None:
+            selected = meet(numpy.flatnonzero(mask))
+        if ids is not None:
+            selected = meet(numpy.asarray(ids, dtype=numpy.intp))
+        if keys is not None:
+            selected = meet(numpy.array([table.index[k] for k in keys], dtype=numpy.intp))
+        if table is not self.__dict__.get("edges") and any(
+                selector is not None for selector in (reflections, order, outside)):
+            raise ValueError("reflections, order and outside select edges only")
+        if reflections is not None:
+            classes = set(self._reflection_class_index[r] for r in reflections)
+            selected = meet(numpy.concatenate(
+                [numpy.arange(self._edge_offsets[c], self._edge_offsets[c+1]) for c in classes]
+                + [numpy.empty(0, dtype=numpy.intp)]))
+        if order is not None:
+            selected = meet(self._order_edge_ids(order))
+        if outside is not None:
+            selected = meet(numpy.flatnonzero(self._outside_edge_labels == outside))
+        if selected is None:
+            return slice(None)
+        return selected
+
+    @lazy_attribute
+    def _outside_edge_labels(self):
+        """
+        The array of the classes in ``self.outside_edges`` of all edges,
+        by edge id.
+        """
+        outside = self.outside_edges
+        return numpy.array([outside[e] for e in self._edge_keys], dtype=object)
+
+    def set_vertex_property(self, name, value, **selectors):
+        """
+        Set the property ``name`` of the selected vertices to ``value`` in
+        one vectorized assignment.
+
+        INPUT:
+
+        - ``name`` -- a vertex property, such as ``"color"`` or ``"radius"``
+
+        - ``value`` -- the new value, or a numpy array with one value (or
+          row, for colors) for each selected vertex in the order of their ids;
+          colors are stored as by Sage's ``rgbcolor``
+
+        - ``mask``, ``ids``, ``keys`` -- selectors as in
+          :meth:`set_edge_property`, with the group elements as keys
+
+        With no selector, all vertices are set.
+
+        OUTPUT:
+
+        The array of the ids of the vertices set, or a slice for all.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: G.set_vertex_property("radius", 2, keys=[W.one()])
+            array([0])
+            sage: G.vertices["radius"][W.one()]
+            2.0
+        """
+        selected = self._select(self.vertices, **selectors)
+        if name == "color":
+            value = _color_value(value)
+        self.vertices.fill(name, value, selected)
+        return selected
+
+    def set_edge_property(self, name, value, **selectors):
+        """
+        Set the property ``name`` of the selected edges to ``value`` in one
+        vectorized assignment.
+
+        INPUT:
+
+        - ``name`` -- an edge property, such as ``"color"``,
+          ``"edge_thickness"`` or ``"visible"``
+
+        - ``value`` -- the new value, or a numpy array with one value (or
+          row, for colors) for each selected edge in the order of their ids;
+          colors are stored as by Sage's ``rgbcolor``
+
+        Edges are selected by all of the given selectors:
+
+        - ``mask`` -- a boolean array indexed by edge id
+
+        - ``ids`` -- a list of edge ids
+
+        - ``keys`` -- a list of edges (tuples of group elements)
+
+        - ``reflections`` -- a list of reflections; their edges are selected
+
+        - ``order`` -- an edge order
+
+        - ``outside`` -- a class of :meth:`_outside_edges`, one of
+          ``"1-face"``, ``"external edge"`` or ``"internal edge"``
+
+        With no selector, all edges are set.
+
+        OUTPUT:
+
+        The array of the ids of the edges set, or a slice for all.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: r = W.reflections()[1]
+            sage: len(G.set_edge_property("color", "red", reflections=[r]))
+            12
+            sage: set(G.edges["color"][e] for e in G.list_edges(r))
+            {(1.0, 0.0, 0.0)}
+            sage: ids = G.set_edge_property("visible", False, outside="internal edge")
+            sage: colors = numpy.random.rand(72, 3)
+            sage: G.set_edge_property("color", colors)
+            slice(None, None, None)
+        """
+        selected = self._select(self.edges, **selectors)
+        if name == "color":
+            value = _color_value(value)
+        self.edges.fill(name, value, selected)
+        return selected
+
+    def edge_thickness(self, edge_thickness=None, **kwds):
         """
         Change the thickness of all edges.
 
@@ -414,6 +1979,9 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
 
         - ``positive real number`` -- the desired thickness
 
+        - ``reflections``, ``edges`` -- (optional) only change the edges of
+          these reflections, or these edges
+
         EXAMPLS:
 
         ::
@@ -423,9 +1991,9 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
         """
         if edge_thickness == None:
             return self.edge_properties["edge_thickness"]
-        self.edge_properties["edge_thickness"] = edge_thickness
-        for edge in self.edges["edge_thickness"].keys():
-            self.edges["edge_thickness"][edge] = edge_thickness
+        if not kwds:
+            self.edge_properties["edge_thickness"] = edge_thickness
+        self.set_edge_property("edge_thickness", edge_thickness, **self._edge_selectors(kwds))
 
     def edge_colors(self):
         return self.edges["color"]
@@ -440,6 +2008,9 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
 
         - ``color`` -- the desired color of all edges
 
+        - ``reflections``, ``edges`` -- (optional) only change the edges of
+          these reflections, or these edges
+
         EXAMPLS:
 
         ::
@@ -449,16 +2020,30 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
         """
         if color == None:
             return self.edge_properties["color"]
-        if "reflections" in kwds:
-            for r in kwds["reflections"]:
-                for e in self.list_edges(r): #make self.edges(r) return the list of edges for reflection r
-                    self.edges["color"][e] = color
-        if "edges" in kwds:
-            for e in kwds["edges"]:
-                self.edges["color"][e] = color
         if len(kwds) == 0:
             self.edge_properties["color"] = color
-            self.edges["color"] = {tuple(e):color for e in cosets}
+        self.set_edge_property("color", color, **self._edge_selectors(kwds))
+
+    def _edge_selectors(self, kwds):
+        """
+        Translate the ``reflections`` and ``edges`` keywords of the edge
+        setters into selectors of :meth:`set_edge_property`.
+
+        Given both, the edges of the reflections and the given edges are
+        changed, so the selection is their union.
+        """
+        unexpected = set(kwds) - {"reflections", "edges"}
+        if unexpected:
+            raise TypeError("unexpected keyword arguments: %s" % ", ".join(sorted(unexpected)))
+        selectors = {}
+        if "reflections" in kwds:
+            selectors["reflections"] = kwds["reflections"]
+        if "edges" in kwds:
+            selectors["keys"] = [tuple(e) for e in kwds["edges"]]
+        if len(selectors) == 2:
+            return {"ids":numpy.union1d(self._select(self.edges, reflections=selectors["reflections"]),
+                                        self._select(self.edges, keys=selectors["keys"]))}
+        return selectors
 
     def vertex_colors(self):
         return self.vertices["color"]
@@ -486,26 +2071,41 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
                 return self.vertex_properties["color"]
             except KeyError:
                 self.vertex_properties["color"] = "gray"
-                self.vertices["color"] = {v:color for v in self.group.list()}
+                self.vertices.fill("color", "gray")
                 return self.vertex_properties["color"]
         # self.vertex_properties["color"]=rgbcolor(c)
         if "vertices" in kwds:
-            for v in kwds["vertices"]:
-                self.vertices["color"][v] = color
+            self.set_vertex_property("color", color, keys=kwds["vertices"])
         if len(kwds) == 0:
             self.vertex_properties["color"] = color
-            for v in self.group.list():
-                self.vertices["color"][v] = color
+            self.set_vertex_property("color", color)
 
 
 
-    def plot3d(self):
+    @_timed
+    def plot3d(self, quality=None, max_triangles=None):
         """
         Create a graphics3dGroup object that represents the reflection
         group, according to chosen visualization parameters.
 
-        This method does not take inputs; changes to parameters should
-        be made using the setter methods.
+        Changes to parameters should be made using the setter methods.
+
+        INPUT:
+
+        - ``quality``, ``max_triangles`` -- (optional) a quality tier and a
+          triangle budget, see :meth:`level_of_detail`. If one is given, the
+          vertices and tubes are drawn as triangle meshes at the chosen
+          resolution, so previews and thumbnails of large groups render
+          faster; otherwise they are Sage points and lines.
+
+        Vertices drawn as Sage points have the point size ``radius``, in
+        pixels; as triangle meshes they are spheres of the radius
+        ``sphere_radius``, in model units, as in :meth:`export_mesh`.
+
+        The graphics primitive of every vertex and edge is cached, and only
+        the primitives of vertices and edges changed since the last call
+        (see ``dirty`` in :class:`_PropertyTable`) are rebuilt. Changing
+        the level of detail rebuilds all of them.
 
         (2018-03-15): Setter methods are not currently implemented.
 
@@ -523,33 +2123,575 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             sage: G.plot3d() #long time
             Graphics3d Object
 
+        Changing the color of one reflection's edges only rebuilds those::
+
+            sage: r = W.reflections()[1]
+            sage: G.edge_color("red", reflections=[r])
+            sage: G.edges.dirty.sum()
+            12
+            sage: G.plot3d() #long time
+            Graphics3d Object
+            sage: G.edges.dirty.sum()
+            0
+
+        A quick preview within a triangle budget::
+
+            sage: G.plot3d(quality="preview", max_triangles=2000) #long time
+            Graphics3d Object
+
 
         SEEALSO:
             :func:`~sage.graphs.generic_graphs.GenericGraph.plot3d`
 
 
         TODO:
-            Permit 4d real and 2d complex reflection group visualization
-            using
-                - Orthogonal projection using proj_plane
-                - Schlegel projection
-                - Stereographic projection
+            Permit 4d real reflection group visualization. Complex
+            reflection groups of rank 2 are projected with the model's
+            projection, see :meth:`set_projection`.
 
         """
-        x = sage.plot.plot3d.base.Graphics3dGroup([])
+        detail = None
+        if quality is not None or max_triangles is not None:
+            detail = self.level_of_detail(quality or "print", max_triangles)
+        if detail != self._plot_detail:
+            self.vertices.dirty[:] = True
+            self.edges.dirty[:] = True
+            self._plot_detail = detail
+
+        columns = self.edges.columns
+        for c, table in enumerate(self._coset_table):
+            offset, end = self._edge_offsets[c], self._edge_offsets[c+1]
+            # only rebuild the visible edges changed since the last call
+            edge_ids = offset + numpy.flatnonzero(columns["visible"][offset:end] &
+                                                  self.edges.dirty[offset:end])
+            if len(edge_ids) == 0:
+                continue
+            if table.shape[1] == 2:
+                for i in edge_ids:
+                    self._edge_graphics[i] = self._create_edge(self._edge_keys[i], detail=detail)
+            else:
+                # extrude all polygons of this order in one pass
+                points, _ = extrude_polygons(self._positions[table[edge_ids - offset]],
+                                             columns["boundary_thickness"][edge_ids])
+                prisms = points.reshape(len(edge_ids), -1, 3)
+                self._stats.count("prisms extruded", len(edge_ids))
+                for i, prism in zip(edge_ids, prisms):
+                    self._edge_graphics[i] = self._create_edge(self._edge_keys[i], prism, detail)
+            self._stats.count("primitives rebuilt", len(edge_ids))
+            self.edges.dirty[edge_ids] = False
+
+        columns = self.vertices.columns
+        vertex_ids = numpy.flatnonzero(columns["visible"] & self.vertices.dirty)
+        if detail is None:
+            for i in vertex_ids:
+                self._vertex_graphics[i] = point3d(self._positions[i].tolist(),
+                                                   color=columns["color"][i],
+                                                   size=columns["radius"][i])
+        elif len(vertex_ids):
+            points, triangles = sphere_mesh(self._positions[vertex_ids],
+                                            columns["sphere_radius"][vertex_ids],
+                                            detail.sphere_segments, detail.sphere_rings)
+            faces = triangles[:len(triangles)//len(vertex_ids)].tolist()
+            for i, sphere in zip(vertex_ids, points.reshape(len(vertex_ids), -1, 3)):
+                self._vertex_graphics[i] = sage.plot.plot3d.index_face_set.IndexFaceSet(
+                    faces, sphere.tolist(), color=columns["color"][i])
+        self._stats.count("primitives rebuilt", len(vertex_ids))
+        self.vertices.dirty[vertex_ids] = False
+
+        return sage.plot.plot3d.base.Graphics3dGroup(
+            [self._edge_graphics[i] for i in numpy.flatnonzero(self.edges.columns["visible"])] +
+            [self._vertex_graphics[i] for i in numpy.flatnonzero(columns["visible"])])
+
+    @_timed
+    def export_mesh(self, output, fmt=None, chunk_size=1000, quality="print",
+                    max_triangles=None, max_bytes=None):
+        r"""
+        Write the model as a triangle mesh for 3d printing.
+
+        Vertices become spheres of their ``sphere_radius``, order 2 edges become
+        tubes of their ``edge_thickness``, and higher order edges become
+        polygons thickened by their ``boundary_thickness``, with tubes along
+        their sides if ``boundaries`` is set. The mesh is generated directly
+        from the vertex and edge tables and streamed to ``output`` in chunks
+        of at most ``chunk_size`` primitives, without building Graphics3d
+        objects.
+
+        INPUT:
 
-        for edge, visible in self.edges['visible'].items():
-            if visible:
-                x += self._create_edge(edge)
+        - ``output`` -- a filename or a writable binary file object
 
-        for vertex, visible in self.vertices['visible'].items():
-            if visible:
-                x += point3d(self.vertices["position"][vertex],
-                                color = self.vertices["color"][vertex],
-                                size = self.vertices["radius"][vertex])
-        return x
+        - ``fmt`` -- one of ``"stl"``, ``"obj"`` or ``"3mf"``; by default
+          it is taken from the extension of ``output``
 
-    def _create_edge(self, coset):
+        - ``chunk_size`` -- the number of primitives meshed at a time
+
+        - ``quality``, ``max_triangles``, ``max_bytes`` -- the level of
+          detail of the spheres and tubes, see :meth:`level_of_detail`;
+          ``"print"`` quality without a budget keeps full detail
+
+        OUTPUT:
+
+        The number of triangles written.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: import io
+            sage: buf = io.BytesIO()
+            sage: G.export_mesh(buf, "stl")
+            4224
+            sage: len(buf.getvalue()) == 84 + 50*4224
+            True
+            sage: G.export_mesh(io.BytesIO(), "stl", quality="thumbnail")
+            1248
+            sage: G.export_mesh(io.BytesIO(), "stl", max_bytes=100000) <= 100000/50
+            True
+        """
+        if fmt is None:
+            fmt = format_from_filename(output)
+        detail = self.level_of_detail(quality, max_triangles, max_bytes, fmt)
+        return write_mesh(output, self._mesh_chunks(chunk_size, detail=detail), fmt)
+
+    def level_of_detail(self, quality="print", max_triangles=None, max_bytes=None,
+                        fmt="stl"):
+        r"""
+        Return the resolution at which the visible vertices and edges are
+        tessellated for the quality tier ``quality`` and the given budget.
+
+        Each tier sets the finest resolution used: ``"print"`` for full
+        detail, ``"preview"`` for interactive views and ``"thumbnail"`` for
+        small images. With a budget of ``max_triangles`` triangles, or of
+        ``max_bytes`` bytes of a mesh file in the format ``fmt``, the
+        spheres, order 2 edge tubes and polygon side tubes are coarsened
+        until the model fits, the kind of primitive saving the most
+        triangles first; the thickened polygons themselves have a fixed
+        number of triangles. See :func:`~cayley_mesh.level_of_detail`.
+
+        OUTPUT:
+
+        A :class:`~cayley_mesh.LevelOfDetail`.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: G.level_of_detail()
+            LevelOfDetail(sphere_segments=8, sphere_rings=6, tube_segments=8, boundary_segments=8)
+            sage: G.level_of_detail(max_triangles=3000)
+            LevelOfDetail(sphere_segments=5, sphere_rings=3, tube_segments=8, boundary_segments=8)
+        """
+        if max_bytes is not None:
+            if fmt not in BYTES_PER_TRIANGLE:
+                raise ValueError("byte budgets are not supported for the format '%s'" % fmt)
+            fitting = max_bytes//BYTES_PER_TRIANGLE[fmt]
+            max_triangles = fitting if max_triangles is None else min(max_triangles, fitting)
+        if max_triangles is None:
+            return level_of_detail(quality)
+
+        counts = {"spheres":int(self.vertices.columns["visible"].sum()),
+                  "tubes":0, "sides":0, "fixed":0}
+        columns = self.edges.columns
+        for c, table in enumerate(self._coset_table):
+            ids = slice(self._edge_offsets[c], self._edge_offsets[c+1])
+            visible = columns["visible"][ids]
+            k = table.shape[1]
+            if k == 2:
+                counts["tubes"] += int(visible.sum())
+                continue
+            counts["sides"] += k*int((visible & columns["boundaries"][ids]).sum())
+            counts["fixed"] += (4*k - 4)*int((visible & columns["fill"][ids]).sum())
+        return level_of_detail(quality, max_triangles, **counts)
+
+    def _mesh_chunks(self, chunk_size=1000, positions=None, detail=None):
+        """
+        Iterate over the meshes of the visible vertices and edges, in chunks
+        of at most ``chunk_size`` primitives.
+
+        The vertex positions are ``self._positions``, unless other positions
+        are given. Spheres and tubes are tessellated at the
+        :class:`~cayley_mesh.LevelOfDetail` ``detail``, by default that of
+        the ``"print"`` quality. See :meth:`export_mesh`.
+        """
+        if detail is None:
+            detail = QUALITY_TIERS["print"]
+        if positions is None:
+            positions = self._positions
+        vertex_ids = numpy.flatnonzero(self.vertices.columns["visible"])
+        radii = self.vertices.columns["sphere_radius"]
+        for start in range(0, len(vertex_ids), chunk_size):
+            chunk = vertex_ids[start:start + chunk_size]
+            yield sphere_mesh(positions[chunk], radii[chunk],
+                              detail.sphere_segments, detail.sphere_rings)
+
+        columns = self.edges.columns
+        for c, table in enumerate(self._coset_table):
+            offset = self._edge_offsets[c]
+            edge_ids = offset + numpy.flatnonzero(columns["visible"][offset:self._edge_offsets[c+1]])
+            for start in range(0, len(edge_ids), chunk_size):
+                chunk = edge_ids[start:start + chunk_size]
+                rows = table[chunk - offset]
+                if table.shape[1] == 2:
+                    yield tube_mesh(positions[rows[:, 0]], positions[rows[:, 1]],
+                                    columns["edge_thickness"][chunk], detail.tube_segments)
+                    continue
+                filled = columns["fill"][chunk]
+                if filled.any():
+                    yield extrude_polygons(positions[rows[filled]],
+                                           columns["boundary_thickness"][chunk[filled]])
+                bounded = columns["boundaries"][chunk]
+                if bounded.any():
+                    sides = rows[bounded]
+                    yield tube_mesh(positions[sides].reshape(-1, 3),
+                                    positions[numpy.roll(sides, -1, axis=1)].reshape(-1, 3),
+                                    numpy.repeat(columns["edge_thickness"][chunk[bounded]],
+                                                 sides.shape[1]),
+                                    detail.boundary_segments)
+
+    @_timed
+    def export_gltf(self, output, segments=16, rings=12):
+        r"""
+        Write the model as a binary glTF (GLB) file for the web viewer.
+
+        Each kind of repeated primitive is stored once and instanced with the
+        ``EXT_mesh_gpu_instancing`` extension: a unit sphere placed at every
+        vertex and scaled by its ``sphere_radius``, and a unit cylinder placed along
+        every order 2 edge and polygon side, scaled by its
+        ``edge_thickness``. The thickened polygons of the higher order edges
+        are merged into one indexed mesh with point colors.
+
+        Sphere and cylinder instances carry their colors in the per-instance
+        attribute ``_COLOR_0`` and their visibility in ``_VISIBLE``, so the
+        viewer can recolor or hide them without rebuilding any buffer;
+        hidden instances are also scaled to zero for viewers that ignore
+        these attributes. Hidden polygons are left out.
+
+        INPUT:
+
+        - ``output`` -- a filename or a writable binary file object
+
+        - ``segments``, ``rings`` -- the resolution of the sphere and
+          cylinder templates
+
+        OUTPUT:
+
+        The number of bytes written.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: import io
+            sage: buf = io.BytesIO()
+            sage: G.export_gltf(buf) == len(buf.getvalue())
+            True
+        """
+        return write_glb(output, *self._gltf_specs(segments, rings))
+
+    def _gltf_specs(self, segments=16, rings=12):
+        """
+        Return the lists of the instanced and merged meshes of
+        :meth:`export_gltf`, as taken by :func:`~cayley_export.write_glb`.
+        """
+        positions = self._positions
+        columns = self.vertices.columns
+        visible = columns["visible"].astype(float)
+        spheres = {"name":"vertices",
+                   "mesh":sphere_mesh([[0, 0, 0]], [1], segments, rings),
+                   "translation":positions,
+                   "scale":numpy.repeat((columns["sphere_radius"]*visible)[:, None], 3, axis=1),
+                   "attributes":{"_COLOR_0":_rgb_colors(columns["color"]),
+                                 "_VISIBLE":visible}}
+
+        columns = self.edges.columns
+        edge_ids, tails, heads = self._tube_segments()
+        starts, ends = positions[tails], positions[heads]
+        lengths = numpy.linalg.norm(ends - starts, axis=1)
+        visible = columns["visible"][edge_ids].astype(float)
+        thickness = columns["edge_thickness"][edge_ids]*visible
+        edge_colors = _rgb_colors(columns["color"])
+        instanced = [spheres]
+        if len(edge_ids):
+            instanced.append({"name":"edges",
+                              "mesh":tube_mesh([[0, 0, 0]], [[0, 1, 0]], [1], segments),
+                              "translation":starts,
+                              "rotation":quaternions_from_y(ends - starts),
+                              "scale":numpy.column_stack((thickness, lengths*visible, thickness)),
+                              "attributes":{"_COLOR_0":edge_colors[edge_ids],
+                                            "_VISIBLE":visible}})
+
+        meshes, colors = [], []
+        for ids, rows in self._polygon_rows():
+            points, triangles = extrude_polygons(positions[rows],
+                                                 columns["boundary_thickness"][ids])
+            meshes.append((points, triangles))
+            colors.append(numpy.repeat(edge_colors[ids], 2*rows.shape[1], axis=0))
+        merged = []
+        if meshes:
+            merged.append({"name":"polygons", "mesh":merge_meshes(meshes),
+                           "colors":numpy.vstack(colors)})
+        return instanced, merged
+
+    @_timed
+    def export_stored(self, filename, meta=None):
+        r"""
+        Write the built model to ``filename`` in the memory-mapped format of
+        :mod:`cayley_catalog`.
+
+        The file holds the vertex positions, the root permutations of the
+        elements, the coset tables and adjacency index, the numeric, boolean
+        and color property columns (colors as RGB rows), the mesh of
+        :meth:`export_mesh`, and the instance buffers and polygon mesh of
+        :meth:`export_gltf`. Other property columns are kept in the
+        metadata, as strings. Worker processes can then open the model with
+        :class:`cayley_catalog.StoredModel` without Sage or gap3.
+
+        INPUT:
+
+        - ``filename`` -- the file to write
+
+        - ``meta`` -- (default: ``None``) a dictionary of further metadata
+          to store, such as the ``"job"`` specification by which a
+          :class:`cayley_catalog.ModelCatalog` finds the model
+
+        OUTPUT:
+
+        The number of triangles of the stored mesh.
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: import io, os, tempfile
+            sage: from cayley_catalog import StoredModel
+            sage: filename = os.path.join(tempfile.mkdtemp(), "A3.cayley")
+            sage: G.export_stored(filename)
+            4224
+            sage: stored = StoredModel(filename)
+            sage: stored.meta["order"], stored.positions.shape
+            (24, (24, 3))
+            sage: stored.export_mesh(io.BytesIO(), "stl")
+            4224
+            sage: buf = io.BytesIO()
+            sage: stored.export_gltf(buf) == G.export_gltf(io.BytesIO())
+            True
+        """
+        arrays = {"positions":self._positions,
+                  "element_perms":numpy.array(self._element_perms, dtype=numpy.int32),
+                  "edge_offsets":numpy.array(self._edge_offsets)}
+        for c, table in enumerate(self._coset_table):
+            arrays["coset_table/%s" % c] = table
+        for name in ("_edge_vertex_ptr", "_edge_vertices", "_vertex_edge_ptr",
+                     "_vertex_edges", "_orders", "_order_edge_ptr", "_order_edges"):
+            arrays[name[1:]] = getattr(self, name)
+
+        other = {}
+        for prefix, table in (("vertex", self.vertices), ("edge", self.edges)):
+            for name, column in table.columns.items():
+                if column.dtype != object:
+                    arrays["%s/%s" % (prefix, name)] = column
+                elif name == "color":
+                    arrays["%s/color" % prefix] = _rgb_colors(column)
+                else:
+                    other["%s/%s" % (prefix, name)] = [None if x is None else str(x)
+                                                       for x in column]
+
+        points, triangles = merge_meshes(self._mesh_chunks())
+        arrays["mesh/points"] = points.astype(numpy.float32)
+        arrays["mesh/triangles"] = triangles.astype(numpy.uint32)
+        gltf_arrays, gltf_layout = pack_gltf(*self._gltf_specs())
+        arrays.update(gltf_arrays)
+
+        meta = dict(meta or {}, group=repr(self.group), order=len(self._elements),
+                    point=[str(x) for x in self.init_point],
+                    proj_plane=[str(x) for x in self.proj_plane],
+                    triangles=len(triangles), columns=other, gltf=gltf_layout)
+        write_stored(filename, arrays, meta)
+        return len(triangles)
+
+    @_timed
+    def check_printability(self, min_thickness=0, clearance=0):
+        r"""
+        Check the visible vertices and edges for collisions and thin
+        features before printing.
+
+        The spheres of the vertices (of their ``sphere_radius``), the tubes of the
+        order 2 edges and polygon boundaries (of their ``edge_thickness``)
+        and the thickened polygons of the higher order edges are binned in
+        a uniform grid (see :func:`~cayley_spatial.candidate_pairs`), so
+        only nearby primitives are tested against each other and the check
+        takes close to linear time in the order of the group.
+
+        Tubes meeting at a vertex and polygons sharing a vertex are joined
+        by design, and are not reported.
+
+        INPUT:
+
+        - ``min_thickness`` -- the thinnest printable feature: spheres and
+          tubes of a smaller diameter, and polygons thickened less, are
+          reported as thin
+
+        - ``clearance`` -- the smallest gap to keep between spheres and
+          between tubes; closer pairs are reported as colliding
+
+        OUTPUT:
+
+        A ``PrintabilityReport`` named tuple of four lists, all empty if
+        the model passes the check:
+
+        - ``vertex_overlaps`` -- triples ``(g, h, depth)`` of group elements
+          whose spheres overlap by ``depth``
+
+        - ``edge_crossings`` -- triples ``(coset, coset, depth)`` of edges
+          whose tubes overlap by ``depth``
+
+        - ``polygon_intersections`` -- pairs ``(coset, coset)`` of edges
+          whose polygons pass through each other
+
+        - ``thin_features`` -- triples ``(kind, key, size)``, where ``kind``
+          is ``"vertex"``, ``"edge"`` or ``"polygon"``, ``key`` is the group
+          element or coset, and ``size`` is its diameter or thickness
+
+        EXAMPLES:
+
+            sage: W = ReflectionGroup(["A",3])
+            sage: G = ReflectionGroup3d(W)
+            sage: G.vertices.fill("sphere_radius", .01)
+            sage: G.check_printability().vertex_overlaps
+            []
+
+        With huge vertices every pair of the 24 spheres overlaps, and the
+        tubes of the edges are too thin to print at a millimeter::
+
+            sage: G.vertices.fill("sphere_radius", 100)
+            sage: report = G.check_printability(min_thickness=1)
+            sage: len(report.vertex_overlaps)
+            276
+            sage: sorted(set(kind for kind, key, size in report.thin_features))
+            ['edge']
+        """
+        positions = self._positions
+        touching = self.tolerance*max(numpy.abs(positions).max(), 1)
+        thin = []
+
+        columns = self.vertices.columns
+        vertex_ids = numpy.flatnonzero(columns["visible"])
+        centers = positions[vertex_ids]
+        radii = columns["sphere_radius"][vertex_ids]
+        pad = (radii + .5*clearance)[:, None]
+        i, j = candidate_pairs(centers - pad, centers + pad).T
+        self._stats.count("candidate pairs", len(i))
+        depth = radii[i] + radii[j] + clearance - numpy.linalg.norm(centers[i] - centers[j], axis=1)
+        hits = numpy.flatnonzero(depth > touching)
+        vertex_overlaps = [(self._elements[vertex_ids[i[n]]], self._elements[vertex_ids[j[n]]],
+                            float(depth[n])) for n in hits]
+        thin += [("vertex", self._elements[v], 2*float(r))
+                 for v, r in zip(vertex_ids, radii) if 2*r < min_thickness]
+
+        columns = self.edges.columns
+        edge_ids, tails, heads = self._tube_segments()
+        shown = columns["visible"][edge_ids]
+        edge_ids, tails, heads = edge_ids[shown], tails[shown], heads[shown]
+        radii = columns["edge_thickness"][edge_ids]
+        pad = (radii + .5*clearance)[:, None]
+        i, j = candidate_pairs(numpy.minimum(positions[tails], positions[heads]) - pad,
+                               numpy.maximum(positions[tails], positions[heads]) + pad).T
+        self._stats.count("candidate pairs", len(i))
+        ends = numpy.column_stack((tails, heads))
+        apart = (edge_ids[i] != edge_ids[j]) & ~share_entries(ends[i], ends[j])
+        i, j = i[apart], j[apart]
+        depth = (radii[i] + radii[j] + clearance -
+                 segment_distances(positions[tails[i]], positions[heads[i]],
+                                   positions[tails[j]], positions[heads[j]]))
+        crossings = {}
+        for n in numpy.flatnonzero(depth > touching):
+            pair = (edge_ids[i[n]], edge_ids[j[n]])
+            crossings[pair] = max(crossings.get(pair, 0), float(depth[n]))
+        edge_crossings = [(self._edge_keys[a], self._edge_keys[b], d)
+                          for (a, b), d in sorted(crossings.items())]
+        thin += [("edge", self._edge_keys[e], 2*float(columns["edge_thickness"][e]))
+                 for e in numpy.unique(edge_ids) if 2*columns["edge_thickness"][e] < min_thickness]
+
+        # fan triangulations of the polygons; any side of a triangle of one
+        # polygon passing through a triangle of another means they intersect
+        triangles, polygon_ids, corners = [], [], []
+        width = max([table.shape[1] for table in self._coset_table])
+        for ids, rows in self._polygon_rows():
+            k = rows.shape[1]
+            fan = numpy.arange(1, k - 1)
+            triangles.append(numpy.stack((rows[:, numpy.zeros(k - 2, dtype=int)],
+                                          rows[:, fan], rows[:, fan + 1]), axis=-1).reshape(-1, 3))
+            polygon_ids.append(numpy.repeat(ids, k - 2))
+            corners.append(numpy.pad(numpy.repeat(rows, k - 2, axis=0), ((0, 0), (0, width - k)),
+                                     "constant", constant_values=-1))
+            thin += [("polygon", self._edge_keys[e], float(columns["boundary_thickness"][e]))
+                     for e in ids if columns["boundary_thickness"][e] < min_thickness]
+        polygon_intersections = []
+        if triangles:
+            triangles = positions[numpy.vstack(triangles)]
+            polygon_ids = numpy.concatenate(polygon_ids)
+            corners = numpy.vstack(corners)
+            pad = (.5*columns["boundary_thickness"][polygon_ids])[:, None]
+            i, j = candidate_pairs(triangles.min(axis=1) - pad, triangles.max(axis=1) + pad).T
+            self._stats.count("candidate pairs", len(i))
+            apart = (polygon_ids[i] != polygon_ids[j]) & ~share_entries(corners[i], corners[j])
+            i, j = i[apart], j[apart]
+            crossing = numpy.zeros(len(i), dtype=bool)
+            for a, b in ((i, j), (j, i)):
+                for side in range(3):
+                    crossing |= segments_cross_triangles(triangles[a, side],
+                                                         triangles[a, (side + 1) % 3],
+                                                         *triangles[b].transpose(1, 0, 2))
+            pairs = set(zip(polygon_ids[i[crossing]].tolist(), polygon_ids[j[crossing]].tolist()))
+            polygon_intersections = [(self._edge_keys[a], self._edge_keys[b])
+                                     for a, b in sorted(pairs)]
+
+        return PrintabilityReport(vertex_overlaps, edge_crossings,
+                                  polygon_intersections, thin)
+
+    def _tube_segments(self):
+        """
+        Return the segments drawn as tubes of ``edge_thickness``: the order 2
+        edges, and the sides of the higher order edges with ``boundaries``.
+
+        OUTPUT:
+
+        Three integer arrays, giving for each segment the id of its edge
+        and the vertex ids of its two ends.
+        """
+        boundaries = self.edges.columns["boundaries"]
+        edge_ids, sides = [], []
+        for c, table in enumerate(self._coset_table):
+            ids = numpy.arange(self._edge_offsets[c], self._edge_offsets[c+1])
+            if table.shape[1] == 2:
+                edge_ids.append(ids)
+                sides.append(table)
+                continue
+            bounded = boundaries[ids]
+            edge_ids.append(numpy.repeat(ids[bounded], table.shape[1]))
+            sides.append(numpy.stack((table[bounded], numpy.roll(table[bounded], -1, axis=1)),
+                                     axis=-1).reshape(-1, 2))
+        sides = numpy.vstack(sides)
+        return numpy.concatenate(edge_ids), sides[:, 0], sides[:, 1]
+
+    def _polygon_rows(self):
+        """
+        Iterate over the visible filled higher order edges, one reflection
+        class at a time, as pairs of their edge ids and the ``(m, k)``
+        array of the vertex ids of their polygons.
+        """
+        columns = self.edges.columns
+        for c, table in enumerate(self._coset_table):
+            if table.shape[1] == 2:
+                continue
+            offset = self._edge_offsets[c]
+            shown = offset + numpy.flatnonzero(columns["visible"][offset:self._edge_offsets[c+1]] &
+                                               columns["fill"][offset:self._edge_offsets[c+1]])
+            if len(shown):
+                yield shown, table[shown - offset]
+
+    @_timed
+    def _create_edge(self, coset, prism=None, detail=None):
         r"""
         Returns graphics edge object based on order of edge.
 
@@ -557,6 +2699,14 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
 
         - ``coset`` -- a tuple defining the edge of a reflection group.
 
+        - ``prism`` -- (optional) for higher order edges, the points of the
+          thickened polygon if they were already computed with
+          :func:`~cayley_mesh.extrude_polygons`.
+
+        - ``detail`` -- (optional) a :class:`~cayley_mesh.LevelOfDetail`;
+          if given, tubes are drawn as triangle meshes at its resolution
+          instead of Sage lines.
+
         OUTPUT:
 
         The edge of the reflection group as a graphics object.
@@ -576,18 +2726,21 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             sage:
 
         """
-        edge_points = [self.vertices["position"][coset_elt] for coset_elt in coset]
+        edge_points = self._positions[[self._element_index[g] for g in coset]]
         if len(coset) == 2:
             # TODO parameters. KEEP INCLUDING MORE HERE
-            return line3d(edge_points, color=self.edges["color"][coset], radius=self.edges["edge_thickness"][coset])
+            if detail is not None:
+                return _tube_graphics(edge_points[:1], edge_points[1:],
+                                      self.edges["edge_thickness"][coset], detail.tube_segments,
+                                      color=self.edges["color"][coset])
+            return line3d(edge_points.tolist(), color=self.edges["color"][coset], radius=self.edges["edge_thickness"][coset])
         else: # length is greater than 2
             _object = sage.plot.plot3d.base.Graphics3dGroup([])
-            edge_polyhedron = Polyhedron(vertices=edge_points)
             if self.edges["fill"][coset]: #fix
-                _object += self._thicken_polygon(edge_polyhedron,
-                            self.edges["boundary_thickness"][coset])
+                _object += self._thicken_polygon(edge_points,
+                            self.edges["boundary_thickness"][coset], prism)
             if self.edges["boundaries"][coset]: #fix
-                _object += self._create_edge_boundaries(edge_polyhedron)
+                _object += self._create_edge_boundaries(edge_points, detail)
 
             if not self.edges["fill"][coset] and not self.edges["boundaries"][coset]:
                 raise NotImplementedError("Visible edge has neither fill nor boundary!")
@@ -595,24 +2748,28 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
             return _object # TODO parameters
 
 
-    def _create_edge_boundaries(self, edge_polyhedron):
+    def _create_edge_boundaries(self, polygon, detail=None):
         r"""
         Return graphics object with boundaries to a higher order edge (order>2).
 
         INPUT:
 
-        - ``edge_polyhedron`` -- a :class:`Polyhedron`.
+        - ``polygon`` -- an array of shape ``(k, 3)`` listing the corners of
+          the edge in cyclic order.
+
+        - ``detail`` -- (optional) a :class:`~cayley_mesh.LevelOfDetail`;
+          if given, the boundaries are triangle meshes at its resolution.
 
         OUTPUT:
 
-        The edges, or boundaries, of the polyhedron as a graphics object.
+        The edges, or boundaries, of the polygon as a graphics object.
 
         EXAMPLES:
 
         ::
             sage: w = ReflectionGroup3d(ReflectionGroup(["A", 3]))
-            sage: poly = Polyhedron(vertices = [[1, 2, 3], [0,1,0], [1,0,1]])
-            sage: edge_boundaries = w._create_edge_boundaries(poly)
+            sage: polygon = numpy.array([[1, 2, 3], [0,1,0], [1,0,1]])
+            sage: edge_boundaries = w._create_edge_boundaries(polygon)
             sage: edge_boundaries.all
             [Graphics3d Object]
 
@@ -621,49 +2778,55 @@ class ReflectionGroup3d(SageObject): # we might want to inherit from an object.
         - provide more visualization options for object.
         """
         _object = sage.plot.plot3d.base.Graphics3dGroup([])
-        edge_face = edge_polyhedron.faces(2)[0]
-        v_list = list(edge_face.vertices())
-        v_list.append(edge_face.vertices()[0])
+        if detail is not None:
+            _object += _tube_graphics(polygon, numpy.roll(polygon, -1, axis=0), .1,
+                                      detail.boundary_segments, color="purple")
+            return _object
+        v_list = polygon.tolist()
+        v_list.append(v_list[0])
         _object += line3d(v_list, color="purple", radius=.1)
 
         return _object
 
-    def _thicken_polygon(self, polytope_in_2d, thickness):
+    @_timed
+    def _thicken_polygon(self, polygon, thickness, prism=None):
         """
-        Return graphics object representing polyhedron in 3d with thickness.
+        Return graphics object representing polygon in 3d with thickness.
+
+        The polygon is extruded along its normal by
+        :func:`~cayley_mesh.extrude_polygons` and drawn as a single
+        triangulated surface.
 
         INPUT:
 
-        - ``polytope_in_2d`` -- a :class:`Polyhedron`.
+        - ``polygon`` -- an array of shape ``(k, 3)`` listing the corners of
+          a planar polygon in cyclic order.
+
+        - ``thickness`` -- the thickness of the prism.
+
+        - ``prism`` -- (optional) the ``2k`` points of the prism, if already
+          computed for a batch of polygons.
 
         OUTPUT:
 
-        A graphics3dGroup object of the same polyhedron in 3d.
+        A graphics3d object of the polygon thickened in 3d.
 
         EXAMPLES:
 
         Example of a polygon edge::
             sage: w = ReflectionGroup3d(ReflectionGroup(["A", 3]))
-            sage: p = Polyhedron(vertices = [[1, 2, 3], [0,1,0], [1,0,1]])
+            sage: p = numpy.array([[1, 2, 3], [0,1,0], [1,0,1]])
             sage: poly_3d = w._thicken_polygon(p, .01)
-            sage: poly_3d.all
-            [Graphics3d Object, Graphics3d Object, Graphics3d Object, Graphics3d Object]
+            sage: len(poly_3d.vertex_list()), len(poly_3d.index_faces())
+            (6, 8)
 
         TODO:
 
         - examples that better test what the graphics object contains
         """
-        new_points = []
-        long_normal_vector = vector(CC,((vector(polytope_in_2d.vertices()[1]) - vector(polytope_in_2d.vertices()[0])).cross_product(vector(polytope_in_2d.vertices()[2]) - vector(polytope_in_2d.vertices()[0]))).normalized())
-        rounded_vector = []
-        for entry in list(long_normal_vector):
-            rounded_vector.append(round(entry,3))
-        normal_vector = vector(rounded_vector)
-
-        for point in polytope_in_2d.vertices():
-            point1 = vector(point) + .5*thickness*normal_vector
-            point2 = vector(point) - .5*thickness*normal_vector
-            new_points.append(point1)
-            new_points.append(point2)
-
-        return Polyhedron(vertices = new_points).plot()
+        if prism is None:
+            prism, _ = extrude_polygons(polygon[None], thickness)
+            self._stats.count("prisms extruded")
+        triangles = prism_triangles(len(polygon))
+        return sage.plot.plot3d.index_face_set.IndexFaceSet(triangles.tolist(),
+                                                             prism.tolist())
@@ -0,0 +1,184 @@
+r"""
+Projections from real 4d space to 3d space.
+
+Complex reflection groups of rank 2 act on $\mathbb{C}^2 = \mathbb{R}^4$, so
+their models are built in real 4d and projected to 3d for visualization and
+printing. A :class:`Projection` is determined by the normal vector of a
+hyperplane in $\mathbb{R}^4$ and a projection mode:
+
+- ``"orthogonal"`` -- parallel projection onto the hyperplane
+
+- ``"schlegel"`` -- perspective projection onto the hyperplane from a point
+  on the normal line, outside of the model
+
+- ``"stereographic"`` -- projection of the sphere containing the model from
+  its point in the direction of the normal
+
+The hyperplane is identified with $\mathbb{R}^3$ through an orthonormal
+basis, computed once when the projection is created; for the normal
+``(0,0,0,1)`` this is the standard basis of the first three coordinates.
+Projections apply to a whole ``(N, 4)`` array of points at once.
+
+This module only depends on numpy.
+
+EXAMPLES::
+
+    >>> points = [[1, 2, 3, 4], [0, 0, 1, -1]]
+    >>> Projection([0, 0, 0, 1])(points).tolist()
+    [[1.0, 2.0, 3.0], [0.0, 0.0, 1.0]]
+
+"""
+
+import numpy
+
+
+MODES = ("orthogonal", "schlegel", "stereographic")
+
+
+def hyperplane_basis(normal):
+    r"""
+    Return an orthonormal basis of the hyperplane of $\mathbb{R}^4$ normal to
+    ``normal``, as the rows of a ``(3, 4)`` array.
+
+    The basis is obtained by Gram-Schmidt from the three standard basis
+    vectors least aligned with ``normal``.
+
+    EXAMPLES::
+
+        >>> hyperplane_basis([0, 0, 0, 2]).tolist()
+        [[1.0, 0.0, 0.0, 0.0], [0.0, 1.0, 0.0, 0.0], [0.0, 0.0, 1.0, 0.0]]
+        >>> basis = hyperplane_basis([1, 1, 1, 1])
+        >>> bool(numpy.allclose(basis.dot([1, 1, 1, 1]), 0))
+        True
+        >>> bool(numpy.allclose(basis.dot(basis.T), numpy.eye(3)))
+        True
+    """
+    normal = numpy.asarray(normal, dtype=float)
+    normal = normal/numpy.linalg.norm(normal)
+    dropped = numpy.argmax(numpy.abs(normal))
+    basis = [normal]
+    for i in range(4):
+        if i == dropped:
+            continue
+        v = numpy.eye(4)[i]
+        for b in basis:
+            v = v - v.dot(b)*b
+        basis.append(v/numpy.linalg.norm(v))
+    return numpy.array(basis[1:])
+
+
+class Projection(object):
+    r"""
+    A projection from $\mathbb{R}^4$ to $\mathbb{R}^3$.
+
+    INPUT:
+
+    - ``proj_plane`` -- a nonzero normal vector in $\mathbb{R}^4$
+
+    - ``mode`` -- one of ``"orthogonal"``, ``"schlegel"`` or ``"stereographic"``
+
+    - ``distance`` -- for Schlegel projections, the distance of the center
+      of projection from the origin, as a multiple of the largest norm of
+      the projected points
+
+    EXAMPLES::
+
+        >>> points = numpy.array([[1, 0, 0, 1], [1, 0, 0, -1]])/numpy.sqrt(2)
+        >>> Projection([0, 0, 0, 1], "stereographic")(points).round(6).tolist()
+        [[2.414214, 0.0, 0.0], [0.414214, 0.0, 0.0]]
+        >>> Projection([0, 0, 0, 1], "schlegel", 2)(points).round(6).tolist()
+        [[1.093836, 0.0, 0.0], [0.522408, 0.0, 0.0]]
+        >>> Projection([0, 0, 0, 1], "perspective")
+        Traceback (most recent call last):
+        ...
+        ValueError: projection mode should be one of orthogonal, schlegel, stereographic
+    """
+    def __init__(self, proj_plane, mode="orthogonal", distance=2):
+        if mode not in MODES:
+            raise ValueError("projection mode should be one of %s" % ", ".join(MODES))
+        self.proj_plane = proj_plane
+        self.mode = mode
+        self.distance = distance
+        normal = numpy.array([float(x) for x in proj_plane])
+        self.normal = normal/numpy.linalg.norm(normal)
+        self.basis = hyperplane_basis(self.normal)
+        # one matrix giving the hyperplane coordinates and the height
+        # along the normal of a point
+        self.operator = numpy.vstack((self.basis, self.normal)).T
+
+    def __call__(self, points, radius=None):
+        """
+        Return the projections of the rows of the ``(N, 4)`` array ``points``.
+
+        Schlegel and stereographic projections are scaled to ``radius``, by
+        default the largest norm of the points; it has to be given to
+        project parts of a model consistently. A point at the center of
+        projection has no image, and raises a ``ValueError``.
+
+        EXAMPLES::
+
+            >>> projection = Projection([0, 0, 0, 1], "stereographic")
+            >>> projection([[1, 0, 0, 0]], radius=2).tolist()
+            [[1.0, 0.0, 0.0]]
+            >>> projection([[1, 0, 0, 0], [0, 0, 0, 1]])
+            Traceback (most recent call last):
+            ...
+            ValueError: point 1 lies at the center of the stereographic projection
+        """
+        points = numpy.asarray(points, dtype=float)
+        coordinates = points.dot(self.operator)
+        projected, heights = coordinates[:, :3], coordinates[:, 3]
+        if self.mode == "orthogonal":
+            return projected
+        if radius is None:
+            radius = numpy.linalg.norm(points, axis=1).max()
+        if self.mode == "schlegel":
+            center = self.distance*radius
+        else:
+            center = radius
+        gaps = center - heights
+        at_center = numpy.flatnonzero(numpy.abs(gaps) <= 1e-12*abs(center))
+        if len(at_center):
+            raise ValueError("point %s lies at the center of the %s projection"
+                             % (at_center[0], self.mode))
+        return projected*(center/gaps)[:, None]
+
+    def __repr__(self):
+        return "%s projection along %s" % (self.mode.capitalize(), tuple(self.proj_plane))
+
+
+def rotation_matrix(i, j, angle):
+    r"""
+    Return the ``4 x 4`` matrix of the rotation of $\mathbb{R}^4$ by ``angle``
+    in the plane of the coordinates ``i`` and ``j``.
+
+    EXAMPLES::
+
+        >>> rotation_matrix(0, 3, numpy.pi/2).dot([1, 0, 0, 0]).round(6).tolist()
+        [0.0, 0.0, 0.0, 1.0]
+    """
+    rotation = numpy.eye(4)
+    c, s = numpy.cos(angle), numpy.sin(angle)
+    rotation[i, i] = rotation[j, j] = c
+    rotation[j, i] = s
+    rotation[i, j] = -s
+    return rotation
+
+
+def rotated_planes(proj_plane, rotation, steps):
+    r"""
+    Iterate over the ``steps`` normal vectors obtained from ``proj_plane`` by
+    repeatedly applying the ``4 x 4`` matrix ``rotation``, starting with
+    ``proj_plane`` itself.
+
+    EXAMPLES::
+
+        >>> planes = rotated_planes([0, 0, 0, 1], rotation_matrix(2, 3, numpy.pi/2), 3)
+        >>> [plane.round(6).tolist() for plane in planes][:2]
+        [[0.0, 0.0, 0.0, 1.0], [0.0, 0.0, -1.0, 0.0]]
+    """
+    rotation = numpy.asarray(rotation, dtype=float)
+    plane = numpy.array([float(x) for x in proj_plane])
+    for step in range(steps):
+        yield plane
+        plane = rotation.dot(plane)
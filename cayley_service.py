@@ -0,0 +1,400 @@
+"""
+Asyncio service serving model files to the web viewer.
+
+A :class:`ModelService` answers requests for the model of a reflection group
+with the bytes of the exported file. Models are built and exported in a pool
+of worker processes, so the event loop is never blocked by Sage, and:
+
+- identical requests (same group, base point, projection plane and format)
+  arriving while a build is in flight wait on that one build, so a burst of
+  requests for a popular model costs a single build
+
+- builds go through a bounded queue; when it is full, new requests are
+  rejected at once with :class:`ServiceBusy` (HTTP 503) instead of piling up
+
+Given a :class:`cayley_catalog.ModelCatalog` directory, for example one
+built by ``cayley_batch.py --format cayley``, the workers serve the models
+it holds from their memory-mapped files, without building them or starting
+Sage, and only build the others.
+
+Requests are jobs as in :mod:`cayley_batch`, optionally with a ``"quality"``
+tier (see :meth:`ReflectionGroup3d.level_of_detail`) for coarser previews;
+glTF files instance a single sphere and tube, and ignore it.
+Over HTTP they are ``GET`` requests such as
+``/model?group=H,3&point=1,2,3&format=glb&quality=preview``, served by
+:func:`serve`; :class:`StandInClient` sends requests to a service in the same
+process, for local testing without a network.
+
+EXAMPLES::
+
+    >>> import asyncio, concurrent.futures
+    >>> from cayley_batch import job_name
+    >>> builds = []
+    >>> def builder(job, fmt):
+    ...     builds.append(job_name(job))
+    ...     return b"solid " + job_name(job).encode()
+    >>> async def burst():
+    ...     service = ModelService(workers=2, builder=builder,
+    ...                            executor=concurrent.futures.ThreadPoolExecutor(2))
+    ...     async with service:
+    ...         client = StandInClient(service)
+    ...         responses = await asyncio.gather(*[client.get("/model?group=H,3")
+    ...                                            for _ in range(10)])
+    ...     return set(r.status for r in responses), responses[0].body, service.stats
+    >>> asyncio.run(burst())
+    ({200}, b'solid H3', {'builds': 1, 'coalesced': 9, 'rejected': 0, 'failed': 0})
+    >>> builds
+    ['H3']
+
+Run a server with a Sage python, for example::
+
+    sage -python cayley_service.py --port 8080 --workers 4
+
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import io
+import json
+import os
+import sys
+from collections import namedtuple
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+from cayley_batch import job_spec, load_model_namespace, make_model
+from cayley_catalog import ModelCatalog
+
+
+FORMATS = ("stl", "obj", "3mf", "glb")
+
+CONTENT_TYPES = {"stl":"model/stl", "obj":"model/obj", "3mf":"model/3mf",
+                 "glb":"model/gltf-binary"}
+
+Response = namedtuple("Response", ["status", "headers", "body"])
+
+_REASONS = {200:"OK", 400:"Bad Request", 404:"Not Found", 405:"Method Not Allowed",
+            500:"Internal Server Error", 503:"Service Unavailable"}
+
+
+class ServiceBusy(Exception):
+    """
+    Raised when the build queue of a :class:`ModelService` is full.
+    """
+
+
+_catalogs = {}
+
+
+def build_model_bytes(job, fmt, catalog=None):
+    """
+    Build the model of ``job`` and return it exported in the format ``fmt``.
+
+    This runs in the worker processes, each holding one Sage session. If
+    the model of ``job`` is in the catalog directory ``catalog``, found by
+    its :func:`cayley_batch.job_spec`, it is read from there instead; each
+    process opens a catalog once, and keeps its models mapped. Catalogs
+    hold models at full detail, so only glTF files, which ignore the
+    quality, and requests at ``"print"`` quality are served from them.
+    """
+    quality = job.get("quality", "print")
+    if catalog is not None and (quality == "print" or fmt == "glb"):
+        if catalog not in _catalogs:
+            _catalogs[catalog] = ModelCatalog(catalog)
+        name = _catalogs[catalog].find(job_spec(job))
+        if name is not None:
+            return _catalogs[catalog].model_bytes(name, fmt)
+    model = make_model(load_model_namespace(), job)
+    buf = io.BytesIO()
+    if fmt == "glb":
+        model.export_gltf(buf)
+    else:
+        model.export_mesh(buf, fmt, quality=quality)
+    return buf.getvalue()
+
+
+def job_key(job, fmt):
+    """
+    Return the key identifying the result of ``job`` in the format ``fmt``.
+
+    EXAMPLES::
+
+        >>> job_key({"group": ["A", 3], "point": (1, 2, 3)}, "stl") == \\
+        ...     job_key({"point": [1.0, 2, 3], "group": ("A", 3), "name": "x"}, "stl")
+        True
+    """
+    return json.dumps(job_spec(job) + [job.get("quality", "print"), fmt])
+
+
+def _numbers(text):
+    """
+    Return the list of the comma separated numbers in ``text``.
+    """
+    return [float(x) if "." in x else int(x) for x in text.split(",")]
+
+
+def parse_job(query):
+    """
+    Return the job described by the query string ``query``.
+
+    EXAMPLES::
+
+        >>> parse_job("group=H,3&point=1,2,3")
+        {'group': ['H', 3], 'point': [1, 2, 3]}
+        >>> parse_job("group=5,1,2&proj_plane=0,1,0,1&quality=thumbnail")
+        {'group': [5, 1, 2], 'proj_plane': [0, 1, 0, 1], 'quality': 'thumbnail'}
+        >>> parse_job("point=1,2")
+        Traceback (most recent call last):
+        ...
+        ValueError: the query does not name a group
+    """
+    fields = {name:values[-1] for name, values in parse_qs(query).items()}
+    if "group" not in fields:
+        raise ValueError("the query does not name a group")
+    group = fields["group"].split(",")
+    if group[0].isalpha():
+        job = {"group":[group[0]] + _numbers(",".join(group[1:]))}
+    else:
+        job = {"group":_numbers(fields["group"])}
+    for name in ("point", "proj_plane"):
+        if name in fields:
+            job[name] = _numbers(fields[name])
+    if "quality" in fields:
+        job["quality"] = fields["quality"]
+    return job
+
+
+class ModelService(object):
+    """
+    Asynchronous builder of model files with request coalescing and
+    backpressure.
+
+    INPUT:
+
+    - ``workers`` -- the number of builds run at the same time (by default
+      the number of cores)
+
+    - ``queue_size`` -- the number of builds that may wait for a worker;
+      further requests are rejected with :class:`ServiceBusy`
+
+    - ``executor`` -- the :mod:`concurrent.futures` executor running the
+      builds; by default a process pool of ``workers`` processes is
+      started with the service and shut down with it
+
+    - ``builder`` -- the function ``builder(job, fmt)`` returning the bytes
+      of a model file, by default :func:`build_model_bytes`
+
+    The service is started and stopped with ``async with``, or with
+    :meth:`start` and :meth:`stop`. The counters in ``stats`` record the
+    builds run, the requests coalesced onto a running build, and the
+    requests rejected or failed.
+    """
+    def __init__(self, workers=None, queue_size=32, executor=None,
+                 builder=build_model_bytes):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.executor = executor
+        self.builder = builder
+        self.stats = {"builds":0, "coalesced":0, "rejected":0, "failed":0}
+        self._own_executor = executor is None
+        self._inflight = {}
+        self._queue = None
+        self._tasks = []
+
+    async def start(self):
+        if self._own_executor:
+            self.executor = concurrent.futures.ProcessPoolExecutor(self.workers)
+        self._queue = asyncio.Queue(self.queue_size)
+        self._tasks = [asyncio.ensure_future(self._work()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """
+        Stop the workers. Requests waiting on a build that was running or
+        queued, and requests made once the service is stopped, fail with
+        :class:`ServiceBusy`.
+
+        EXAMPLES::
+
+            >>> import asyncio, concurrent.futures, time
+            >>> async def interrupted():
+            ...     service = ModelService(workers=1, builder=lambda job, fmt: time.sleep(.2),
+            ...                            executor=concurrent.futures.ThreadPoolExecutor(1))
+            ...     await service.start()
+            ...     requests = [asyncio.ensure_future(service.get({"group": ["A", n]}))
+            ...                 for n in (2, 2, 3)]
+            ...     await asyncio.sleep(.05)
+            ...     await service.stop()
+            ...     requests.append(asyncio.ensure_future(service.get({"group": ["A", 2]})))
+            ...     results = await asyncio.gather(*requests, return_exceptions=True)
+            ...     return [type(result).__name__ for result in results]
+            >>> asyncio.run(interrupted())
+            ['ServiceBusy', 'ServiceBusy', 'ServiceBusy', 'ServiceBusy']
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        while self._queue is not None and not self._queue.empty():
+            key, job, fmt, future = self._queue.get_nowait()
+            future.set_exception(ServiceBusy("the service stopped before building the model"))
+            del self._inflight[key]
+            self._queue.task_done()
+        self._queue = None
+        if self._own_executor:
+            self.executor.shutdown()
+
+    async def __aenter__(self):
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def get(self, job, fmt="stl"):
+        """
+        Return the bytes of the model of ``job`` exported in the format
+        ``fmt``, waiting on the build already running for the same model
+        if there is one.
+        """
+        if fmt not in FORMATS:
+            raise ValueError("unknown format '%s', should be one of %s" % (fmt, ", ".join(FORMATS)))
+        if self._queue is None:
+            raise ServiceBusy("the service is not running")
+        key = job_key(job, fmt)
+        future = self._inflight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+        else:
+            if self._queue.full():
+                self.stats["rejected"] += 1
+                raise ServiceBusy("%s builds are waiting" % self._queue.qsize())
+            future = asyncio.get_event_loop().create_future()
+            # the result is retrieved here too, in case every caller is cancelled
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            self._inflight[key] = future
+            self._queue.put_nowait((key, job, fmt, future))
+        # one caller giving up does not cancel the build for the others
+        return await asyncio.shield(future)
+
+    async def _work(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            key, job, fmt, future = await self._queue.get()
+            self.stats["builds"] += 1
+            try:
+                result = await loop.run_in_executor(self.executor, self.builder, job, fmt)
+            except asyncio.CancelledError:
+                # the service is stopping: release the requests waiting here
+                future.set_exception(ServiceBusy("the service stopped before building the model"))
+                raise
+            except Exception as error:
+                self.stats["failed"] += 1
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+            finally:
+                del self._inflight[key]
+                self._queue.task_done()
+
+    async def handle(self, target):
+        """
+        Answer a ``GET`` request for ``target``, such as
+        ``"/model?group=A,3&format=stl"``, with a :class:`Response`.
+        """
+        url = urlsplit(target)
+        if url.path != "/model":
+            return _error(404, "no such resource %s" % url.path)
+        try:
+            job = parse_job(url.query)
+            fmt = parse_qs(url.query).get("format", ["stl"])[-1]
+            body = await self.get(job, fmt)
+        except ValueError as error:
+            return _error(400, str(error))
+        except ServiceBusy as error:
+            response = _error(503, str(error))
+            response.headers["Retry-After"] = "1"
+            return response
+        except Exception as error:
+            return _error(500, "%s: %s" % (type(error).__name__, error))
+        return Response(200, {"Content-Type":CONTENT_TYPES[fmt],
+                              "Content-Length":str(len(body))}, body)
+
+
+def _error(status, message):
+    body = message.encode("utf-8")
+    return Response(status, {"Content-Type":"text/plain; charset=utf-8",
+                             "Content-Length":str(len(body))}, body)
+
+
+class StandInClient(object):
+    """
+    Client sending requests straight to the handler of a service in the same
+    process, in place of an HTTP client, for local testing.
+
+    EXAMPLES::
+
+        >>> async def missing():
+        ...     async with ModelService(workers=1, builder=None,
+        ...                             executor=concurrent.futures.ThreadPoolExecutor(1)) as service:
+        ...         return await StandInClient(service).get("/models")
+        >>> asyncio.run(missing()).status
+        404
+    """
+    def __init__(self, service):
+        self.service = service
+
+    async def get(self, target):
+        return await self.service.handle(target)
+
+
+async def serve(service, host="127.0.0.1", port=8080):
+    """
+    Serve the ``GET`` requests of :meth:`ModelService.handle` over HTTP,
+    one request per connection, and return the :class:`asyncio.Server`.
+    """
+    async def connection(reader, writer):
+        try:
+            request = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()).strip():
+                pass
+            if len(request) != 3:
+                response = _error(400, "malformed request")
+            elif request[0] != "GET":
+                response = _error(405, "only GET is supported")
+            else:
+                response = await service.handle(request[1])
+            head = ["HTTP/1.1 %s %s" % (response.status, _REASONS[response.status])]
+            head += ["%s: %s" % item for item in sorted(response.headers.items())]
+            head += ["Connection: close", "", ""]
+            writer.write("\r\n".join(head).encode("latin-1") + response.body)
+            await writer.drain()
+        finally:
+            writer.close()
+    return await asyncio.start_server(connection, host, port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve model files over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None,
+                        help="number of worker processes (default: number of cores)")
+    parser.add_argument("--queue-size", type=int, default=32,
+                        help="number of builds that may wait for a worker")
+    parser.add_argument("--catalog", help="directory of stored models to serve without building them")
+    args = parser.parse_args(argv)
+
+    async def run():
+        builder = partial(build_model_bytes, catalog=args.catalog)
+        async with ModelService(args.workers, args.queue_size, builder=builder) as service:
+            server = await serve(service, args.host, args.port)
+            sys.stderr.write("serving on %s:%s\n" % (args.host, args.port))
+            async with server:
+                await server.serve_forever()
+    asyncio.run(run())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Uniform grid spatial index and batched geometric tests.
+
+Checking every pair of primitives of a model against each other is
+quadratic in the group order. Instead, the axis-aligned bounding boxes of
+the primitives are binned into a uniform grid whose cells are as large as
+the largest box, so each box meets at most eight cells, and only boxes
+sharing a cell are paired up. For models whose primitives have similar
+sizes, as the vertices and edges of a Cayley graph do, the number of
+candidate pairs grows linearly with the number of primitives. The exact
+tests then run on all candidate pairs at once.
+
+This module only depends on numpy.
+
+EXAMPLES::
+
+    >>> import numpy
+    >>> centers = numpy.array([[0, 0, 0], [1.5, 0, 0], [10, 0, 0]])
+    >>> candidate_pairs(centers - 1, centers + 1).tolist()
+    [[0, 1]]
+
+"""
+
+import itertools
+
+import numpy
+
+
+def candidate_pairs(lower, upper, cell_size=None):
+    """
+    Return the pairs of boxes that may intersect.
+
+    INPUT:
+
+    - ``lower``, ``upper`` -- arrays of shape ``(n, 3)``, the opposite
+      corners of ``n`` axis-aligned boxes
+
+    - ``cell_size`` -- the side of the grid cells; by default the largest
+      side of a box
+
+    OUTPUT:
+
+    An integer array of shape ``(p, 2)`` of the sorted pairs ``(i, j)``,
+    ``i < j``, of boxes meeting a common grid cell. Every pair of
+    intersecting boxes is among them.
+
+    EXAMPLES::
+
+        >>> lower = numpy.array([[0, 0, 0], [.5, .5, .5], [.9, 0, 0], [3, 3, 3]])
+        >>> candidate_pairs(lower, lower + 1).tolist()
+        [[0, 1], [0, 2], [1, 2]]
+        >>> candidate_pairs(numpy.zeros((1, 3)), numpy.ones((1, 3))).shape
+        (0, 2)
+    """
+    lower = numpy.asarray(lower, dtype=float).reshape(-1, 3)
+    upper = numpy.asarray(upper, dtype=float).reshape(-1, 3)
+    if len(lower) < 2:
+        return numpy.empty((0, 2), dtype=int)
+    if cell_size is None:
+        cell_size = (upper - lower).max()
+    cell_size = cell_size if cell_size > 0 else 1.
+    origin = lower.min(axis=0)
+    first = numpy.floor((lower - origin)/cell_size).astype(int)
+    spans = numpy.floor((upper - origin)/cell_size).astype(int) - first + 1
+
+    # list every (cell, box) incidence
+    cells, boxes = [], []
+    for offset in itertools.product(*[range(s) for s in spans.max(axis=0)]):
+        meets = (numpy.array(offset) < spans).all(axis=1)
+        cells.append(first[meets] + offset)
+        boxes.append(numpy.flatnonzero(meets))
+    _, cells = numpy.unique(numpy.vstack(cells), axis=0, return_inverse=True)
+    cells = cells.reshape(-1)
+    boxes = numpy.concatenate(boxes)
+
+    order = numpy.lexsort((boxes, cells))
+    cells, boxes = cells[order], boxes[order]
+    starts = numpy.flatnonzero(numpy.r_[True, cells[1:] != cells[:-1]])
+    sizes = numpy.diff(numpy.r_[starts, len(cells)])
+    pairs = [numpy.empty((0, 2), dtype=int)]
+    # cells holding the same number of boxes are paired up together
+    for size in numpy.unique(sizes[sizes > 1]):
+        members = boxes[starts[sizes == size][:, None] + numpy.arange(size)]
+        i, j = numpy.triu_indices(size, 1)
+        pairs.append(numpy.stack((members[:, i], members[:, j]), axis=-1).reshape(-1, 2))
+    pairs = numpy.vstack(pairs)
+    if len(pairs) == 0:
+        return pairs
+    return numpy.unique(pairs, axis=0)
+
+
+def segment_distances(p1, q1, p2, q2):
+    """
+    Return the distances between the segments ``[p1[i], q1[i]]`` and
+    ``[p2[i], q2[i]]``, for all rows ``i`` at once.
+
+    EXAMPLES::
+
+        >>> segment_distances([[0, 0, 0]], [[2, 0, 0]], [[1, -1, 1]], [[1, 1, 1]]).tolist()
+        [1.0]
+        >>> segment_distances([[0, 0, 0]], [[1, 0, 0]], [[3, 0, 0]], [[4, 0, 0]]).tolist()
+        [2.0]
+    """
+    p1, q1, p2, q2 = [numpy.asarray(x, dtype=float).reshape(-1, 3) for x in (p1, q1, p2, q2)]
+    d1, d2, r = q1 - p1, q2 - p2, p1 - p2
+    a = (d1*d1).sum(axis=1)
+    e = (d2*d2).sum(axis=1)
+    b = (d1*d2).sum(axis=1)
+    c = (d1*r).sum(axis=1)
+    f = (d2*r).sum(axis=1)
+    denominator = a*e - b*b
+    parallel = denominator <= 1e-12*numpy.maximum(a*e, 1e-300)
+    s = numpy.where(parallel, 0, (b*f - c*e)/numpy.where(parallel, 1, denominator))
+    s = numpy.clip(s, 0, 1)
+    t = (b*s + f)/numpy.where(e > 0, e, 1)
+    t = numpy.clip(t, 0, 1)
+    # with t clamped, recompute the closest point on the first segment
+    s = numpy.clip((b*t - c)/numpy.where(a > 0, a, 1), 0, 1)
+    return numpy.linalg.norm(p1 + s[:, None]*d1 - p2 - t[:, None]*d2, axis=1)
+
+
+def segments_cross_triangles(p, q, a, b, c, eps=1e-9):
+    """
+    Return whether each segment ``[p[i], q[i]]`` passes through the interior
+    of the triangle ``(a[i], b[i], c[i])``, for all rows ``i`` at once.
+
+    Segments merely touching the triangle, or lying in its plane, do not
+    count as crossing it.
+
+    EXAMPLES::
+
+        >>> triangle = [[0, 0, 0]], [[2, 0, 0]], [[0, 2, 0]]
+        >>> segments_cross_triangles([[.5, .5, -1]], [[.5, .5, 1]], *triangle).tolist()
+        [True]
+        >>> segments_cross_triangles([[.5, .5, 0]], [[.5, .5, 1]], *triangle).tolist()
+        [False]
+        >>> segments_cross_triangles([[3, 3, -1]], [[3, 3, 1]], *triangle).tolist()
+        [False]
+    """
+    p, q, a, b, c = [numpy.asarray(x, dtype=float).reshape(-1, 3) for x in (p, q, a, b, c)]
+    direction = q - p
+    e1, e2 = b - a, c - a
+    h = numpy.cross(direction, e2)
+    det = (e1*h).sum(axis=1)
+    flat = numpy.abs(det) <= eps*numpy.linalg.norm(direction, axis=1)*numpy.linalg.norm(e1, axis=1)*numpy.linalg.norm(e2, axis=1)
+    inverse = 1/numpy.where(flat, 1, det)
+    r = p - a
+    u = (r*h).sum(axis=1)*inverse
+    k = numpy.cross(r, e1)
+    v = (direction*k).sum(axis=1)*inverse
+    t = (e2*k).sum(axis=1)*inverse
+    return ~flat & (u > eps) & (v > eps) & (u + v < 1 - eps) & (t > eps) & (t < 1 - eps)
+
+
+def share_entries(rows1, rows2):
+    """
+    Return whether the rows ``rows1[i]`` and ``rows2[i]`` have an entry in
+    common, for all rows ``i`` at once. Negative entries are padding.
+
+    EXAMPLES::
+
+        >>> share_entries([[0, 1, -1], [2, 3, 4]], [[1, 5, 6], [5, 6, -1]]).tolist()
+        [True, False]
+    """
+    rows1, rows2 = numpy.asarray(rows1), numpy.asarray(rows2)
+    equal = rows1[:, :, None] == rows2[:, None, :]
+    return (equal & (rows1[:, :, None] >= 0)).any(axis=(1, 2))